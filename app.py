@@ -1,20 +1,38 @@
 import streamlit as st
 import sqlite3
 import os
+import mmap
+import queue
+import threading
+import time
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from io import BytesIO
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter # Corrected import statement
-from reportlab.lib import colors
-from reportlab.platypus import Table, TableStyle, SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
 from werkzeug.utils import secure_filename
 import base64
+import collections
+import functools
+import hashlib
+import hmac
+import itertools
+import json
+import logging
+import mimetypes
+import secrets
+import tempfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote
 import re
-from PIL import Image
+import unicodedata
+import zipfile
 from datetime import datetime
+import numpy as np
 import pandas as pd
-import altair as alt
+# reportlab, altair y Pillow se importan solo en las vistas que los usan,
+# para no pagar su carga en el arranque ni en las páginas que no los necesitan
+
+logger = logging.getLogger(__name__)
 
 # Configuración de la aplicación Streamlit
 st.set_page_config(page_title="Control de rentas-inquilinos", page_icon=":house:", layout="wide")
@@ -22,77 +40,1518 @@ st.set_page_config(page_title="Control de rentas-inquilinos", page_icon=":house:
 # Configuración de la base de datos
 DATABASE = 'database.db'
 UPLOAD_FOLDER = 'uploads'
+UPLOAD_TMP_FOLDER = os.path.join(UPLOAD_FOLDER, '.tmp')
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_GC_INTERVAL = 3600  # segundos entre pasadas completas del recolector de archivos
+UPLOAD_GC_GRACE_SECONDS = 3600  # los archivos más recientes pueden estar aún sin registrar
+UPLOAD_GC_BATCH_SIZE = 500
+THUMBNAIL_FOLDER = 'thumbnails'
+UPLOAD_WORKERS = 4  # hilos que normalizan y guardan los archivos subidos
+
+# Normalización de las fotos de comprobantes al subirlas
+IMAGE_MAX_DIMENSION = int(os.environ.get('RENTAPP_IMAGE_MAX_DIMENSION', '2400'))
+IMAGE_FORMAT = os.environ.get('RENTAPP_IMAGE_FORMAT', 'WEBP').upper().replace('JPG', 'JPEG')
+if IMAGE_FORMAT not in ('WEBP', 'JPEG'):
+    # Otro formato acabaría guardado con extensión y MIME de JPEG
+    raise ValueError(f"RENTAPP_IMAGE_FORMAT debe ser WEBP o JPEG, no {IMAGE_FORMAT!r}")
+IMAGE_QUALITY = int(os.environ.get('RENTAPP_IMAGE_QUALITY', '80'))
+IMAGE_KEEP_ORIGINAL = os.environ.get('RENTAPP_IMAGE_KEEP_ORIGINAL', '').lower() in ('1', 'true', 'yes')
+
+# Carga masiva de comprobantes: propiedad, mes y año se deducen del nombre
+RECEIPT_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.pdf')
+BATCH_UPLOAD_MAX_FILE_BYTES = 50 * 1024 * 1024  # por archivo dentro de un zip
+RECEIPT_FILENAME_PATTERNS = [
+    # p12_2024-03, propiedad-12_202403, 12/2024-03
+    re.compile(r'^[a-z]*[\s_.-]*(?P<propiedad>\d+)[\s_.-]+(?P<anio>\d{4})[\s_.-]?(?P<mes>\d{1,2})$'),
+    # 12_Marzo_2024, p12-mar-2024
+    re.compile(r'^[a-z]*[\s_.-]*(?P<propiedad>\d+)[\s_.-]+(?P<mes>[a-z]{3,})[\s_.-]+(?P<anio>\d{4})$'),
+]
+
+# Servidor de descargas de comprobantes (enlaces firmados con soporte de rangos HTTP)
+FILE_SERVER_HOST = os.environ.get('RENTAPP_FILE_SERVER_HOST', '127.0.0.1')
+FILE_SERVER_PORT = int(os.environ.get('RENTAPP_FILE_SERVER_PORT', '8502'))
+FILE_SERVER_URL = os.environ.get('RENTAPP_FILE_SERVER_URL')  # URL pública si hay un proxy delante
+FILE_SERVER_SECRET = os.environ.get('RENTAPP_FILE_SERVER_SECRET')  # clave HMAC común a todos los procesos
+FILE_SERVER_KEY_FILE = 'file_server.key'  # clave generada si no se define la variable
+FILE_LINK_TTL = 3600
+
+# Instrumentación opcional: RENTAPP_PROFILE=1 o ?debug=1 en la URL
+PROFILE_ENABLED = os.environ.get('RENTAPP_PROFILE', '').lower() in ('1', 'true', 'yes')
+PROFILE_LOG = os.environ.get('RENTAPP_PROFILE_LOG', 'profile.jsonl')
+
+# Miniaturas de comprobantes (se generan al doble del ancho mostrado)
+THUMBNAIL_DISPLAY_WIDTH = 100
+THUMBNAIL_SIZE = (200, 200)
+THUMBNAIL_QUALITY = 75
+THUMBNAIL_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# Meses del año; su posición + 1 es el valor de comprobantes.mes_num
+MESES = ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"]
+COMPROBANTES_PAGE_SIZE = 12
+PROPIEDADES_PAGE_SIZE = 30  # múltiplo de las 3 columnas de la grilla
+DATA_VERSION_TTL = 30  # segundos antes de releer la versión escrita por otros procesos
+
+# Mapa de calor de pagos en la página principal
+HEATMAP_MESES = 24
+HEATMAP_MAX_PROPIEDADES = 60
+
+# Informe de inquilinos
+REPORT_TABLE_CHUNK = 500
+REPORT_CACHE_VERSIONS = 2
+
+# Configuración del pool de conexiones SQLite
+DB_POOL_SIZE = 8
+DB_BUSY_TIMEOUT_MS = 5000
+DB_CACHED_STATEMENTS = 256
+DB_PRAGMAS = {
+    'synchronous': 'NORMAL',
+    'cache_size': -20000,  # en KiB (~20 MB por conexión)
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+    'busy_timeout': DB_BUSY_TIMEOUT_MS,
+    'foreign_keys': 'ON',
+}
+WRITE_BATCH_MAX = 64  # operaciones confirmadas juntas como máximo (group commit)
+WRITE_RETRIES = 6
+WRITE_RETRY_DELAY = 0.05  # segundos; se duplica en cada reintento
+
+# Instrumentación de reruns y tareas en segundo plano
+class RerunProfile:
+    """Timings and counters collected while one rerun or background job runs"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.elapsed = None
+        self.queries = {}  # SQL normalizado -> [ejecuciones, segundos, filas]
+        self.sections = collections.defaultdict(float)
+        self.counters = collections.Counter()
+
+    def add_query(self, sql, seconds, rows):
+        stats = self.queries.setdefault(' '.join(sql.split()), [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+        stats[2] += rows
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self._start
+
+    def as_dict(self):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self._start
+        return {
+            'ts': datetime.fromtimestamp(self.started_at).isoformat(timespec='milliseconds'),
+            'tipo': self.kind,
+            'total_ms': round(elapsed * 1000, 2),
+            'consultas': sum(stats[0] for stats in self.queries.values()),
+            'consultas_ms': round(sum(stats[1] for stats in self.queries.values()) * 1000, 2),
+            'sql': [
+                {'sql': sql, 'ejecuciones': count, 'ms': round(seconds * 1000, 2), 'filas': rows}
+                for sql, (count, seconds, rows) in sorted(self.queries.items(), key=lambda item: -item[1][1])
+            ],
+            'secciones_ms': {name: round(seconds * 1000, 2) for name, seconds in self.sections.items()},
+            'contadores': dict(self.counters),
+        }
+
+
+_profiling = threading.local()
+_profile_log_lock = threading.Lock()
+
+def current_profile():
+    return getattr(_profiling, 'profile', None)
+
+def profiling_enabled():
+    return PROFILE_ENABLED or st.query_params.get('debug') == '1'
+
+@contextmanager
+def profiling(kind, enabled=True):
+    """Collect a RerunProfile for the enclosed code and append it to PROFILE_LOG"""
+    if not enabled:
+        yield None
+        return
+    profile = RerunProfile(kind)
+    previous = current_profile()
+    _profiling.profile = profile
+    try:
+        yield profile
+    finally:
+        # También al salir por st.rerun() o por una excepción
+        _profiling.profile = previous
+        profile.finish()
+        try:
+            line = json.dumps(profile.as_dict(), ensure_ascii=False)
+            with _profile_log_lock, open(PROFILE_LOG, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        except OSError:
+            logger.exception("No se pudo escribir el registro de instrumentación")
+
+@contextmanager
+def profiled(section):
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.sections[section] += time.perf_counter() - start
+
+def count_profile(counter, amount=1):
+    profile = current_profile()
+    if profile is not None:
+        profile.counters[counter] += amount
+
+def render_profile_panel(profile):
+    data = profile.as_dict()
+    with st.sidebar.expander("Depuración: rendimiento del rerun", expanded=True):
+        st.metric("Tiempo total", f"{data['total_ms']:.0f} ms")
+        st.metric("Consultas SQL", f"{data['consultas']} ({data['consultas_ms']:.1f} ms)")
+        for counter, value in sorted(data['contadores'].items()):
+            st.write(f"{counter}: {value:,}")
+        if data['secciones_ms']:
+            st.dataframe(pd.DataFrame(sorted(data['secciones_ms'].items(), key=lambda item: -item[1]), columns=['Sección', 'ms']), hide_index=True)
+        if data['sql']:
+            st.dataframe(pd.DataFrame(data['sql']), hide_index=True)
+        st.caption(f"Registro: {PROFILE_LOG}")
 
-# Asegurar que la carpeta 'uploads' exista
-if not os.path.exists(UPLOAD_FOLDER):
-    os.makedirs(UPLOAD_FOLDER)
 
 # Funciones para la base de datos
-def get_db_connection():
-    conn = sqlite3.connect(DATABASE)
+def connect_db(database):
+    """Open a SQLite connection with the app's pragmas"""
+    conn = sqlite3.connect(
+        database,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        check_same_thread=False,
+        cached_statements=DB_CACHED_STATEMENTS,
+    )
     conn.row_factory = sqlite3.Row
+    for pragma, value in DB_PRAGMAS.items():
+        conn.execute(f'PRAGMA {pragma}={value}')
     return conn
 
+class ConnectionPool:
+    """Thread-safe pool of tuned SQLite connections shared by all sessions"""
+
+    def __init__(self, database, size=DB_POOL_SIZE):
+        self.database = database
+        self.size = size
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._created = 0
+        with self.connection() as conn:
+            # WAL es persistente en el archivo: basta con activarlo una vez
+            conn.execute('PRAGMA journal_mode=WAL')
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return connect_db(self.database)
+                except Exception:
+                    self._created -= 1
+                    raise
+        # Pool agotado: esperar a que otra sesión devuelva una conexión
+        return self._idle.get(timeout=DB_BUSY_TIMEOUT_MS / 1000)
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put_nowait(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        finally:
+            self._release(conn)
+
+
+@st.cache_resource
+def get_db_pool():
+    return ConnectionPool(DATABASE)
+
+@contextmanager
+def get_db_connection():
+    with get_db_pool().connection() as conn:
+        # Confirma al salir del bloque o revierte si hubo una excepción
+        with conn:
+            yield conn
+
+@contextmanager
+def read_snapshot():
+    """Connection inside a read transaction: every query sees the same snapshot"""
+    with get_db_pool().connection() as conn:
+        conn.execute('BEGIN DEFERRED')
+        try:
+            yield conn
+        finally:
+            conn.rollback()
+
+
+def _is_locked(error):
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in str(error) or 'busy' in str(error))
+
+class WriteQueue:
+    """Single writer thread that applies every mutation of this process
+
+    Operations queued while a transaction is being committed are applied
+    together in the next one (group commit), each inside its own savepoint
+    so a failing operation doesn't undo the others. "database is locked"
+    from writers in other processes is retried with exponential backoff.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, fn):
+        """Queue fn(conn) and return a Future with (result, data version)"""
+        future = Future()
+        self._queue.put((fn, future))
+        return future
+
+    def run(self, fn):
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Una operación de escritura no puede encolar otra: use la conexión recibida")
+        return self.submit(fn).result()
+
+    def _run(self):
+        conn = None
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH_MAX:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            batch = [(fn, future) for fn, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            if conn is None:
+                try:
+                    conn = connect_db(self.database)
+                except Exception as e:
+                    # Sin conexión el hilo sigue vivo: falla el lote y se reintenta con el siguiente
+                    logger.exception("No se pudo abrir la base de datos para escribir")
+                    for _, future in batch:
+                        future.set_exception(e)
+                    continue
+            self._commit(conn, batch)
+
+    def _commit(self, conn, batch):
+        delay = WRITE_RETRY_DELAY
+        for attempt in range(WRITE_RETRIES + 1):
+            results = []
+            try:
+                conn.execute('BEGIN IMMEDIATE')
+                for fn, future in batch:
+                    conn.execute('SAVEPOINT operacion')
+                    try:
+                        value = fn(conn)
+                    except Exception as e:
+                        if _is_locked(e):
+                            raise
+                        conn.execute('ROLLBACK TO operacion')
+                        results.append((future, None, e))
+                    else:
+                        results.append((future, value, None))
+                    conn.execute('RELEASE operacion')
+                version = conn.execute("SELECT version FROM version_datos WHERE id = 1").fetchone()
+                conn.commit()
+            except Exception as e:
+                if conn.in_transaction:
+                    conn.rollback()
+                if _is_locked(e) and attempt < WRITE_RETRIES:
+                    # Otro proceso tiene el bloqueo de escritura: esperar y reintentar el lote
+                    time.sleep(delay * random.uniform(0.5, 1.5))
+                    delay *= 2
+                    continue
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+            version = version[0] if version is not None else None
+            for future, value, error in results:
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result((value, version))
+            return
+
+
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue(DATABASE)
+
+def run_in_writer(fn):
+    """Run fn(conn) in the writer's transaction and return its result
+
+    Use it for writes that need several statements to be atomic; fn must
+    only use the connection it receives.
+    """
+    value, version = get_write_queue().run(fn)
+    if version is not None:
+        # Invalida de inmediato las cachés que dependen de la versión de los datos
+        get_data_version_tracker().update(version)
+    return value
+
 def query_db(query, args=(), one=False):
-    with get_db_connection() as conn:
+    start = time.perf_counter()
+    with read_snapshot() as conn:
         cursor = conn.cursor()
         cursor.execute(query, args)
         results = cursor.fetchall()
-        return (results[0] if results else None) if one else results
+    profile = current_profile()
+    if profile is not None:
+        profile.add_query(query, time.perf_counter() - start, len(results))
+    return (results[0] if results else None) if one else results
 
 def execute_db(query, args=()):
-    with get_db_connection() as conn:
-        cursor = conn.cursor()
-        cursor.execute(query, args)
-        conn.commit()
-        return cursor.lastrowid
-
-# Inicialización de la base de datos al iniciar la aplicación
-def setup_database():
-    with get_db_connection() as db:
-        cursor = db.cursor()
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS propiedades (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                propiedad_id INTEGER UNIQUE,
-                valor_renta REAL,
-                arrendatario TEXT,
-                fecha_inicio DATE,
-                garantia INTEGER,
-                monto_deposito REAL,
-                comprobante_garantia TEXT,
-                comprobante_contrato TEXT
-            )
+    start = time.perf_counter()
+
+    def execute(conn):
+        cursor = conn.execute(query, args)
+        return cursor.lastrowid, cursor.rowcount
+
+    lastrowid, rowcount = run_in_writer(execute)
+    profile = current_profile()
+    if profile is not None:
+        profile.add_query(query, time.perf_counter() - start, max(rowcount, 0))
+    return lastrowid
+
+def add_propiedad():
+    """Insert a property with the next free propiedad_id and return that ID"""
+    def insert(conn):
+        # El MAX y el INSERT van en la misma sentencia, dentro de la transacción del escritor
+        cursor = conn.execute("INSERT INTO propiedades (propiedad_id) SELECT COALESCE(MAX(propiedad_id), 0) + 1 FROM propiedades")
+        return conn.execute("SELECT propiedad_id FROM propiedades WHERE id = ?", (cursor.lastrowid,)).fetchone()[0]
+    return run_in_writer(insert)
+
+# Migraciones del esquema: cada una se aplica una sola vez, en orden, y
+# PRAGMA user_version guarda cuántas se aplicaron. Las primeras comprueban el
+# estado actual porque las bases creadas antes de este sistema tienen
+# user_version 0 pero pueden incluir ya parte de esos cambios.
+def _add_missing_columns(db, table, columns):
+    existing_columns = [col['name'] for col in db.execute(f"PRAGMA table_info({table})")]
+    for name, column_type in columns.items():
+        if name not in existing_columns:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+def _migration_base_schema(db):
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS propiedades (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            propiedad_id INTEGER UNIQUE,
+            valor_renta REAL,
+            arrendatario TEXT,
+            fecha_inicio DATE,
+            garantia INTEGER,
+            monto_deposito REAL,
+            comprobante_garantia TEXT,
+            comprobante_contrato TEXT
+        )
+    ''')
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS comprobantes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            propiedad_id INTEGER,
+            nombre TEXT,
+            mes TEXT,
+            anio INTEGER,
+            FOREIGN KEY (propiedad_id) REFERENCES propiedades (propiedad_id) ON DELETE CASCADE
+        )
+    ''')
+    # Propiedades iniciales, solo en una base de datos nueva
+    if db.execute("SELECT 1 FROM propiedades LIMIT 1").fetchone() is None:
+        db.executemany("INSERT INTO propiedades (propiedad_id) VALUES (?)", [(i,) for i in range(1, 10)])
+
+def _migration_mes_num(db):
+    """Numeric month and composite index to sort and paginate receipts"""
+    comprobante_columns = [col['name'] for col in db.execute("PRAGMA table_info(comprobantes)")]
+    if 'mes_num' not in comprobante_columns:
+        db.execute("ALTER TABLE comprobantes ADD COLUMN mes_num INTEGER")
+        db.executemany("UPDATE comprobantes SET mes_num = ? WHERE mes = ?", [(i, mes) for i, mes in enumerate(MESES, start=1)])
+    db.execute("CREATE INDEX IF NOT EXISTS idx_comprobantes_periodo ON comprobantes (propiedad_id, anio, mes_num)")
+
+def _migration_upload_store(db):
+    """Metadata of the content-addressed upload store"""
+    _add_missing_columns(db, 'comprobantes', {'ruta': 'TEXT', 'sha256': 'TEXT', 'tamano': 'INTEGER', 'mime': 'TEXT'})
+    _add_missing_columns(db, 'propiedades', {'contrato_ruta': 'TEXT', 'contrato_sha256': 'TEXT', 'contrato_tamano': 'INTEGER', 'contrato_mime': 'TEXT'})
+    db.execute("CREATE INDEX IF NOT EXISTS idx_comprobantes_ruta ON comprobantes (ruta)")
+    db.execute("CREATE INDEX IF NOT EXISTS idx_propiedades_contrato_ruta ON propiedades (contrato_ruta)")
+
+def _migration_cascade_delete(db):
+    """Recreate comprobantes with ON DELETE CASCADE (SQLite can't alter a foreign key)"""
+    foreign_keys = db.execute("PRAGMA foreign_key_list(comprobantes)").fetchall()
+    if all(fk['on_delete'] == 'CASCADE' for fk in foreign_keys):
+        return
+    columns = 'id, propiedad_id, nombre, mes, anio, mes_num, ruta, sha256, tamano, mime'
+    db.execute('''
+        CREATE TABLE comprobantes_nueva (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            propiedad_id INTEGER,
+            nombre TEXT,
+            mes TEXT,
+            anio INTEGER,
+            mes_num INTEGER,
+            ruta TEXT,
+            sha256 TEXT,
+            tamano INTEGER,
+            mime TEXT,
+            FOREIGN KEY (propiedad_id) REFERENCES propiedades (propiedad_id) ON DELETE CASCADE
+        )
+    ''')
+    db.execute(f"INSERT INTO comprobantes_nueva ({columns}) SELECT {columns} FROM comprobantes")
+    db.execute("DROP TABLE comprobantes")
+    db.execute("ALTER TABLE comprobantes_nueva RENAME TO comprobantes")
+    # DROP TABLE elimina también sus índices y triggers; los triggers los
+    # vuelven a crear las migraciones siguientes
+    db.execute("CREATE INDEX idx_comprobantes_periodo ON comprobantes (propiedad_id, anio, mes_num)")
+    db.execute("CREATE INDEX idx_comprobantes_ruta ON comprobantes (ruta)")
+
+def _migration_data_version(db):
+    """Data version counter, bumped by triggers on every write"""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS version_datos (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    db.execute("INSERT OR IGNORE INTO version_datos (id, version) VALUES (1, 0)")
+    for table in ('propiedades', 'comprobantes'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            db.execute(f'''
+                CREATE TRIGGER IF NOT EXISTS trg_version_{table}_{event.lower()}
+                AFTER {event} ON {table}
+                BEGIN
+                    UPDATE version_datos SET version = version + 1 WHERE id = 1;
+                END
+            ''')
+
+def _migration_payment_ledger(db):
+    """Materialized property × month matrix kept up to date by triggers on comprobantes"""
+    ledger_exists = db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pagos_mensuales'").fetchone()
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS pagos_mensuales (
+            propiedad_id INTEGER NOT NULL,
+            periodo INTEGER NOT NULL,
+            comprobantes INTEGER NOT NULL,
+            PRIMARY KEY (propiedad_id, periodo)
+        ) WITHOUT ROWID
+    ''')
+    if not ledger_exists:
+        db.execute('''
+            INSERT INTO pagos_mensuales (propiedad_id, periodo, comprobantes)
+            SELECT propiedad_id, anio * 12 + mes_num - 1, COUNT(*)
+            FROM comprobantes
+            WHERE anio IS NOT NULL AND mes_num IS NOT NULL
+            GROUP BY propiedad_id, anio, mes_num
         ''')
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS comprobantes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                propiedad_id INTEGER,
-                nombre TEXT,
-                mes TEXT,
-                anio INTEGER,
-                FOREIGN KEY (propiedad_id) REFERENCES propiedades (propiedad_id)
+    # periodo = anio * 12 + mes_num - 1 (meses desde el año 0)
+    add_payment = '''
+        INSERT INTO pagos_mensuales (propiedad_id, periodo, comprobantes)
+        SELECT new.propiedad_id, new.anio * 12 + new.mes_num - 1, 1
+        WHERE new.anio IS NOT NULL AND new.mes_num IS NOT NULL
+        ON CONFLICT (propiedad_id, periodo) DO UPDATE SET comprobantes = comprobantes + 1;
+    '''
+    remove_payment = '''
+        UPDATE pagos_mensuales SET comprobantes = comprobantes - 1
+        WHERE propiedad_id = old.propiedad_id AND periodo = old.anio * 12 + old.mes_num - 1;
+        DELETE FROM pagos_mensuales
+        WHERE propiedad_id = old.propiedad_id AND periodo = old.anio * 12 + old.mes_num - 1 AND comprobantes <= 0;
+    '''
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_pagos_insert AFTER INSERT ON comprobantes BEGIN {add_payment} END")
+    db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_pagos_delete AFTER DELETE ON comprobantes BEGIN {remove_payment} END")
+    db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_pagos_update AFTER UPDATE OF propiedad_id, anio, mes_num ON comprobantes
+        BEGIN {remove_payment} {add_payment} END
+    """)
+
+def _migration_search_index(db):
+    """FTS5 indexes over tenants, property IDs and receipts, kept in sync by triggers"""
+    # Índices de contenido externo: solo guardan los términos, el texto sigue en las tablas
+    indexes = {
+        'propiedades_fts': ('propiedades', ['propiedad_id', 'arrendatario']),
+        'comprobantes_fts': ('comprobantes', ['nombre', 'mes', 'anio']),
+    }
+    for fts, (table, columns) in indexes.items():
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f"new.{column}" for column in columns)
+        old_values = ', '.join(f"old.{column}" for column in columns)
+        db.execute(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                {column_list}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
             )
-        ''')
-        existing_properties = query_db("SELECT propiedad_id FROM propiedades")
-        existing_ids = [prop['propiedad_id'] for prop in existing_properties]
-        for i in range(1, 10):
-            if i not in existing_ids:
+        """)
+        db.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        insert = f"INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});"
+        delete = f"INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});"
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_insert AFTER INSERT ON {table} BEGIN {insert} END")
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_delete AFTER DELETE ON {table} BEGIN {delete} END")
+        db.execute(f"CREATE TRIGGER IF NOT EXISTS trg_{fts}_update AFTER UPDATE OF {column_list} ON {table} BEGIN {delete} {insert} END")
+
+def _migration_original_uploads(db):
+    """Original file of a receipt whose image was normalized at upload time"""
+    _add_missing_columns(db, 'comprobantes', {'original_nombre': 'TEXT', 'original_ruta': 'TEXT', 'original_tamano': 'INTEGER', 'original_mime': 'TEXT'})
+    db.execute("CREATE INDEX IF NOT EXISTS idx_comprobantes_original_ruta ON comprobantes (original_ruta)")
+
+# El orden es definitivo: agregar migraciones nuevas siempre al final
+MIGRATIONS = [
+    _migration_base_schema,
+    _migration_mes_num,
+    _migration_upload_store,
+    _migration_cascade_delete,
+    _migration_data_version,
+    _migration_payment_ledger,
+    _migration_search_index,
+    _migration_original_uploads,
+]
+
+def migrate(db):
+    """Apply pending MIGRATIONS, each in its own transaction, and return the schema version"""
+    # Las claves foráneas se desactivan durante los cambios de esquema (no se
+    # puede hacer dentro de una transacción), como recomienda SQLite
+    db.execute('PRAGMA foreign_keys=OFF')
+    try:
+        for version, migration in enumerate(MIGRATIONS, start=1):
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                # Releer dentro de la transacción: otro proceso pudo migrar antes
+                if db.execute('PRAGMA user_version').fetchone()[0] >= version:
+                    db.rollback()
+                    continue
+                migration(db)
+                db.execute(f'PRAGMA user_version = {version}')
+                db.commit()
+            except Exception:
+                db.rollback()
+                raise
+    finally:
+        db.execute('PRAGMA foreign_keys=ON')
+    return db.execute('PRAGMA user_version').fetchone()[0]
+
+# Inicialización al iniciar el proceso: Streamlit vuelve a ejecutar el script
+# en cada interacción, pero st.cache_resource hace que esto corra una sola vez
+@st.cache_resource
+def init_database():
+    for folder in (UPLOAD_FOLDER, UPLOAD_TMP_FOLDER, THUMBNAIL_FOLDER):
+        os.makedirs(folder, exist_ok=True)
+    with get_db_pool().connection() as db:
+        version = migrate(db)
+    # El recolector arranca con el proceso para que la pasada periódica
+    # corra aunque nunca se elimine nada
+    get_upload_gc()
+    return version
+
+class DataVersionTracker:
+    """In-process copy of version_datos so idle reruns don't touch the database
+
+    execute_db pushes the new version after every write; changes made by
+    other processes are picked up once the copy is older than DATA_VERSION_TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_at = 0.0
+
+    def get(self):
+        if self._version is None or time.monotonic() - self._checked_at > DATA_VERSION_TTL:
+            self.update(query_db("SELECT version FROM version_datos WHERE id = 1", one=True)['version'])
+        return self._version
+
+    def update(self, version):
+        with self._lock:
+            if self._version is None or version > self._version:
+                self._version = version
+            self._checked_at = time.monotonic()
+
+
+@st.cache_resource
+def get_data_version_tracker():
+    return DataVersionTracker()
+
+def get_data_version():
+    """Version stamp of propiedades/comprobantes, bumped by triggers on every write"""
+    return get_data_version_tracker().get()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def load_propiedades(version):
+    """Load the home page data in one query; cached until the data version changes"""
+    with read_snapshot() as conn:
+        propiedades = pd.read_sql_query(
+            'SELECT propiedad_id, valor_renta, arrendatario FROM propiedades ORDER BY propiedad_id',
+            conn,
+        )
+    propiedades['ocupada'] = propiedades['arrendatario'].fillna('').ne('')
+    return propiedades
+
+def fts_terms(texto):
+    """Split free text into safe FTS5 prefix queries, one per word"""
+    # Cada palabra va entre comillas para que los operadores de FTS5 se traten como texto
+    return [f'"{palabra}"*' for palabra in re.findall(r'\w+', texto or '')]
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def search_propiedades(version, texto, cursor=None, limit=PROPIEDADES_PAGE_SIZE):
+    """Return one page of the home grid and the keyset cursor of the next page
+
+    With search text, a property matches when every word matches its ID
+    or tenant, or the name or period of one of its receipts; different
+    words may match different places.
+    """
+    filtros = ['propiedad_id > ?']
+    args = [-1 if cursor is None else cursor]
+    for termino in fts_terms(texto):
+        filtros.append('''(
+            id IN (SELECT rowid FROM propiedades_fts WHERE propiedades_fts MATCH ?)
+            OR propiedad_id IN (
+                SELECT c.propiedad_id FROM comprobantes_fts JOIN comprobantes c ON c.id = comprobantes_fts.rowid
+                WHERE comprobantes_fts MATCH ?
+            )
+        )''')
+        args += [termino, termino]
+    propiedades = query_db(f'''
+        SELECT propiedad_id, arrendatario FROM propiedades
+        WHERE {' AND '.join(filtros)}
+        ORDER BY propiedad_id
+        LIMIT ?
+    ''', (*args, limit + 1))
+    propiedades = [
+        {'propiedad_id': propiedad['propiedad_id'], 'ocupada': bool(propiedad['arrendatario'])}
+        for propiedad in propiedades
+    ]
+    next_cursor = None
+    if len(propiedades) > limit:
+        propiedades = propiedades[:limit]
+        next_cursor = propiedades[-1]['propiedad_id']
+    return propiedades, next_cursor
+
+def periodo_label(periodo):
+    return f"{MESES[periodo % 12]} {periodo // 12}"
+
+
+class LedgerEngine:
+    """Vectorized payment analytics over the property × month matrix
+
+    Rows follow ``propiedad_ids`` and columns follow ``periodos`` (months as
+    ``anio * 12 + mes - 1``). A month is expected to be paid from the
+    tenant's fecha_inicio up to the current month while the property is
+    occupied; rent and tenancy history are not stored, so the current
+    values are applied to every period.
+    """
+
+    def __init__(self, propiedades, pagos, periodo_actual):
+        self.propiedades = propiedades.reset_index(drop=True)
+        self.periodo_actual = periodo_actual
+        fecha_inicio = pd.to_datetime(self.propiedades['fecha_inicio'], errors='coerce')
+        inicio = (fecha_inicio.dt.year * 12 + fecha_inicio.dt.month - 1).to_numpy(dtype=float)
+        ocupada = self.propiedades['arrendatario'].fillna('').ne('').to_numpy()
+
+        candidatos = [periodo_actual, *pagos['periodo'].agg(['min', 'max']).dropna()]
+        if not np.isnan(inicio).all():
+            candidatos.append(np.nanmin(inicio))
+        self.periodos = np.arange(int(min(candidatos)), int(max(candidatos)) + 1)
+
+        self.pagado = np.zeros((len(self.propiedades), len(self.periodos)), dtype=bool)
+        filas = pd.Index(self.propiedades['propiedad_id']).get_indexer(pagos['propiedad_id'])
+        columnas = pagos['periodo'].to_numpy(dtype=np.int64) - self.periodos[0]
+        validos = filas >= 0
+        self.pagado[filas[validos], columnas[validos]] = True
+
+        self.esperado = (
+            ocupada[:, None]
+            & (self.periodos[None, :] >= inicio[:, None])  # NaN (sin fecha) nunca cumple
+            & (self.periodos[None, :] <= periodo_actual)
+        )
+        self.adeudado = self.esperado & ~self.pagado
+
+    def arrears(self):
+        """Properties with unpaid months, most months owed first"""
+        meses_adeudados = self.adeudado.sum(axis=1)
+        resumen = self.propiedades[['propiedad_id', 'arrendatario', 'valor_renta']].assign(
+            meses_adeudados=meses_adeudados,
+            monto_adeudado=meses_adeudados * self.propiedades['valor_renta'].fillna(0).to_numpy(),
+        )
+        resumen = resumen[resumen['meses_adeudados'] > 0]
+        return resumen.sort_values(['meses_adeudados', 'propiedad_id'], ascending=[False, True])
+
+    def unpaid_periods(self, propiedad_id):
+        fila = np.flatnonzero(self.propiedades['propiedad_id'].to_numpy() == propiedad_id)
+        if not len(fila):
+            return []
+        return [periodo_label(periodo) for periodo in self.periodos[self.adeudado[fila[0]]]]
+
+    def occupancy_by_period(self):
+        ocupadas = self.esperado.sum(axis=0)
+        return pd.DataFrame({
+            'periodo': self.periodos,
+            'ocupadas': ocupadas,
+            'tasa_ocupacion': ocupadas / max(len(self.propiedades), 1),
+        })
+
+    def income_by_period(self):
+        renta = self.propiedades['valor_renta'].fillna(0).to_numpy()
+        return pd.DataFrame({
+            'periodo': self.periodos,
+            'ingreso': renta @ self.pagado,
+            'ingreso_esperado': renta @ self.esperado,
+        })
+
+    def heatmap_frame(self, meses=HEATMAP_MESES, max_propiedades=HEATMAP_MAX_PROPIEDADES):
+        """Long-format cells for the most recent months of the properties most in arrears"""
+        columnas = np.flatnonzero((self.periodos <= self.periodo_actual) & (self.periodos > self.periodo_actual - meses))
+        adeudado = self.adeudado[:, columnas].sum(axis=1)
+        filas = np.lexsort((self.propiedades['propiedad_id'].to_numpy(), -adeudado))[:max_propiedades]
+        estado = np.where(self.pagado[np.ix_(filas, columnas)], 'Pagado',
+                          np.where(self.adeudado[np.ix_(filas, columnas)], 'Adeudado', 'Sin contrato'))
+        periodos = self.periodos[columnas]
+        return pd.DataFrame({
+            'Propiedad': np.repeat(self.propiedades['propiedad_id'].to_numpy()[filas].astype(str), len(columnas)),
+            'Periodo': np.tile([f"{periodo // 12}-{periodo % 12 + 1:02d}" for periodo in periodos], len(filas)),
+            'Estado': estado.ravel(),
+        })
+
+
+@st.cache_resource(max_entries=2, show_spinner=False)
+def get_ledger(version, periodo_actual):
+    """Ledger for a data version and month; shared read-only between sessions
+
+    The current month is part of the key so a new month starts counting as
+    owed even if nothing was written across the month boundary.
+    """
+    with read_snapshot() as conn:
+        propiedades = pd.read_sql_query(
+            'SELECT propiedad_id, valor_renta, arrendatario, fecha_inicio FROM propiedades ORDER BY propiedad_id',
+            conn,
+        )
+        cursor = conn.cursor()
+        cursor.row_factory = None  # tuplas simples: sqlite3.Row duplica el coste en cargas grandes
+        pagos = pd.DataFrame(
+            np.array(cursor.execute('SELECT propiedad_id, periodo FROM pagos_mensuales').fetchall(), dtype=np.int64).reshape(-1, 2),
+            columns=['propiedad_id', 'periodo'],
+        )
+    return LedgerEngine(propiedades, pagos, periodo_actual)
+
+def current_periodo():
+    hoy = datetime.now()
+    return hoy.year * 12 + hoy.month - 1
+
+def get_comprobantes_page(propiedad_id, cursor=None, limit=COMPROBANTES_PAGE_SIZE):
+    """Return one page of receipts (newest first) and the keyset cursor of the next page"""
+    if cursor is None:
+        comprobantes = query_db('''
+            SELECT * FROM comprobantes
+            WHERE propiedad_id = ?
+            ORDER BY anio DESC, mes_num DESC, id DESC
+            LIMIT ?
+        ''', (propiedad_id, limit + 1))
+    else:
+        comprobantes = query_db('''
+            SELECT * FROM comprobantes
+            WHERE propiedad_id = ? AND (anio, mes_num, id) < (?, ?, ?)
+            ORDER BY anio DESC, mes_num DESC, id DESC
+            LIMIT ?
+        ''', (propiedad_id, *cursor, limit + 1))
+    next_cursor = None
+    if len(comprobantes) > limit:
+        comprobantes = comprobantes[:limit]
+        last = comprobantes[-1]
+        next_cursor = (last['anio'], last['mes_num'], last['id'])
+    return comprobantes, next_cursor
+
+def comprobante_row(propiedad_id, mes, anio, stored):
+    """Values for insert_comprobantes from a prepare_upload result"""
+    original = stored.get('original') or {}
+    return (
+        propiedad_id, stored['nombre'], mes, anio, MESES.index(mes) + 1,
+        stored['ruta'], stored['sha256'], stored['tamano'], stored['mime'],
+        original.get('nombre'), original.get('ruta'), original.get('tamano'), original.get('mime'),
+    )
+
+def insert_comprobantes(rows):
+    """Insert receipts in one write transaction and return how many were added
+
+    A receipt with the same content as one already stored for that
+    property and month is skipped.
+    """
+    def insert(conn):
+        # ?1 propiedad_id, ?4 anio, ?5 mes_num, ?7 sha256
+        cursor = conn.executemany('''
+            INSERT INTO comprobantes (propiedad_id, nombre, mes, anio, mes_num, ruta, sha256, tamano, mime,
+                                      original_nombre, original_ruta, original_tamano, original_mime)
+            SELECT ?1, ?2, ?3, ?4, ?5, ?6, ?7, ?8, ?9, ?10, ?11, ?12, ?13
+            WHERE NOT EXISTS (
+                SELECT 1 FROM comprobantes WHERE propiedad_id = ?1 AND anio = ?4 AND mes_num = ?5 AND sha256 = ?7
+            )
+        ''', rows)
+        return cursor.rowcount
+    return run_in_writer(insert)
+
+# Almacén de archivos direccionado por contenido
+def upload_path(ruta, nombre=None):
+    """Path on disk of a stored file; legacy rows without ruta live flat in uploads/"""
+    if ruta:
+        return os.path.join(UPLOAD_FOLDER, *ruta.split('/'))
+    return os.path.join(UPLOAD_FOLDER, nombre)
+
+def guess_mime(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def store_upload(fileobj, filename):
+    """Stream a file into the upload store and return its metadata
+
+    The content is written in chunks while it is hashed and then moved to
+    uploads/<aa>/<bb>/<sha256>, so identical files are stored only once.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    os.makedirs(UPLOAD_TMP_FOLDER, exist_ok=True)  # puede haberse borrado con la app en marcha
+    fd, tmp_path = tempfile.mkstemp(dir=UPLOAD_TMP_FOLDER)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            fileobj.seek(0)
+            while True:
+                chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+        ruta = f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+        filepath = upload_path(ruta)
+        if os.path.exists(filepath):
+            # Renueva el periodo de gracia del recolector para el archivo reutilizado
+            os.utime(filepath)
+        else:
+            while True:
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                try:
+                    os.replace(tmp_path, filepath)
+                    break
+                except FileNotFoundError:
+                    # El recolector borró el directorio vacío entre medias: recrearlo
+                    if not os.path.exists(tmp_path):
+                        raise
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return {
+        'nombre': secure_filename(filename),
+        'ruta': ruta,
+        'sha256': sha256,
+        'tamano': size,
+        'mime': guess_mime(filename),
+    }
+
+NORMALIZABLE_MIMES = ('image/png', 'image/jpeg')
+
+def normalize_image(fileobj):
+    """Re-encode a photo upright, capped to IMAGE_MAX_DIMENSION, in IMAGE_FORMAT
+
+    Returns (BytesIO, extension), or None when the image can't be read or
+    re-encoding would not make it any smaller.
+    """
+    from PIL import ExifTags, Image, ImageOps, features
+
+    image_format = IMAGE_FORMAT if IMAGE_FORMAT == 'JPEG' or features.check('webp') else 'JPEG'
+    try:
+        original_size = fileobj.seek(0, os.SEEK_END)
+        fileobj.seek(0)
+        image = Image.open(fileobj)
+        # exif_transpose devuelve siempre una copia: la rotación se decide por la etiqueta
+        rotated = image.getexif().get(ExifTags.Base.Orientation, 1) not in (1, None)
+        resized = max(image.size) > IMAGE_MAX_DIMENSION
+        # Decodificación reducida para JPEG grandes: suficiente para el tamaño final
+        image.draft('RGB', (IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION))
+        image = ImageOps.exif_transpose(image)
+        if max(image.size) > IMAGE_MAX_DIMENSION:
+            image.thumbnail((IMAGE_MAX_DIMENSION, IMAGE_MAX_DIMENSION), Image.LANCZOS)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            # JPEG no admite transparencia: se compone sobre fondo blanco
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        elif image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+        output = BytesIO()
+        image.save(output, format=image_format, quality=IMAGE_QUALITY, **({'method': 4} if image_format == 'WEBP' else {'optimize': True}))
+    except Exception:
+        logger.warning("No se pudo normalizar la imagen subida", exc_info=True)
+        return None
+    finally:
+        fileobj.seek(0)
+    if not (rotated or resized) and output.tell() >= original_size:
+        # Ni girada ni reducida, y no ocupa menos: se conserva el archivo original
+        return None
+    output.seek(0)
+    return output, '.webp' if image_format == 'WEBP' else '.jpg'
+
+def prepare_upload(fileobj, filename):
+    """Normalize a receipt image if possible and store it
+
+    Returns the store_upload metadata plus 'original', the metadata of the
+    untouched file when it was replaced and IMAGE_KEEP_ORIGINAL is set.
+    """
+    original = None
+    if guess_mime(filename) in NORMALIZABLE_MIMES:
+        normalized = normalize_image(fileobj)
+        if normalized is not None:
+            data, extension = normalized
+            if IMAGE_KEEP_ORIGINAL:
+                original = store_upload(fileobj, filename)
+            stored = store_upload(data, os.path.splitext(filename)[0] + extension)
+            stored['original'] = original
+            return stored
+    stored = store_upload(fileobj, filename)
+    stored['original'] = original
+    return stored
+
+@st.cache_resource
+def get_upload_executor():
+    """Shared pool that normalizes and stores uploads off the script thread"""
+    return ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix='upload')
+
+@st.fragment(run_every=1)
+def upload_progress(job_key):
+    job = st.session_state.get(job_key)
+    if job is None or job['future'].done():
+        # Rerun completo para registrar el comprobante fuera del fragmento
+        st.rerun()
+    st.info(f"Procesando {job['nombre']}...")
+
+def parse_receipt_filename(path):
+    """Return (propiedad_id, mes_num, anio) encoded in a receipt's path, or None
+
+    Folders count as part of the name, so "12/2024-03.pdf" works like
+    "12_2024-03.pdf"; outer folders that don't fit, such as "2024/" in
+    "2024/12_2024-03.pdf", are skipped. Month names may be abbreviated to
+    three letters.
+    """
+    stem = os.path.splitext(path.replace('\\', '/').strip('/'))[0]
+    stem = unicodedata.normalize('NFKD', stem.lower()).encode('ascii', 'ignore').decode()
+    parts = stem.split('/')
+    # Primero la ruta completa; después, sin las carpetas exteriores de una en una
+    for start in range(len(parts)):
+        parsed = _match_receipt_stem('_'.join(parts[start:]))
+        if parsed is not None:
+            return parsed
+    return None
+
+def _match_receipt_stem(stem):
+    for pattern in RECEIPT_FILENAME_PATTERNS:
+        match = pattern.match(stem)
+        if match is None:
+            continue
+        mes = match['mes']
+        if mes.isdigit():
+            mes_num = int(mes)
+        else:
+            candidatos = [i for i, nombre in enumerate(MESES, start=1) if nombre.lower().startswith(mes)]
+            mes_num = candidatos[0] if len(candidatos) == 1 else None
+        anio = int(match['anio'])
+        if mes_num is not None and 1 <= mes_num <= 12 and 2000 <= anio <= 2100:
+            return int(match['propiedad']), mes_num, anio
+    return None
+
+def batch_upload_entries(uploaded_files, propiedad_ids):
+    """Expand uploaded files and zip archives into receipts mapped from their names"""
+    entries = []
+
+    def add(nombre, origen, tamano):
+        entry = {'archivo': nombre, 'origen': origen, 'propiedad_id': None, 'mes_num': None, 'anio': None}
+        parsed = parse_receipt_filename(nombre)
+        if os.path.splitext(nombre)[1].lower() not in RECEIPT_EXTENSIONS:
+            entry['estado'] = "Tipo de archivo no soportado"
+        elif tamano > BATCH_UPLOAD_MAX_FILE_BYTES:
+            entry['estado'] = "Archivo demasiado grande"
+        elif parsed is None:
+            entry['estado'] = "No se reconoce propiedad, mes y año en el nombre"
+        else:
+            entry['propiedad_id'], entry['mes_num'], entry['anio'] = parsed
+            entry['estado'] = "Listo" if entry['propiedad_id'] in propiedad_ids else "La propiedad no existe"
+        entries.append(entry)
+
+    for uploaded_file in uploaded_files:
+        if os.path.splitext(uploaded_file.name)[1].lower() != '.zip':
+            add(uploaded_file.name, uploaded_file, uploaded_file.size)
+            continue
+        zip_bytes = uploaded_file.getvalue()
+        try:
+            with zipfile.ZipFile(BytesIO(zip_bytes)) as archive:
+                members = [info for info in archive.infolist() if not info.is_dir() and not info.filename.startswith('__MACOSX/')]
+        except zipfile.BadZipFile:
+            entries.append({'archivo': uploaded_file.name, 'origen': None, 'propiedad_id': None, 'mes_num': None, 'anio': None,
+                            'estado': "Zip dañado"})
+            continue
+        for info in members:
+            add(info.filename, (zip_bytes, info.filename), info.file_size)
+    return entries
+
+def prepare_batch_entry(entry):
+    """Normalize and store one batch receipt; zip members are read in the worker"""
+    origen = entry['origen']
+    if isinstance(origen, tuple):
+        zip_bytes, member = origen
+        # Cada hilo abre su propio lector sobre los mismos bytes
+        with zipfile.ZipFile(BytesIO(zip_bytes)) as archive:
+            fileobj = BytesIO(archive.read(member))
+        return prepare_upload(fileobj, os.path.basename(member))
+    return prepare_upload(origen, origen.name)
+
+@st.fragment(run_every=1)
+def batch_upload_progress(job_key):
+    job = st.session_state.get(job_key)
+    terminados = sum(future.done() for _, future in job['trabajos']) if job else 0
+    if job is None or terminados == len(job['trabajos']):
+        # Un único rerun completo para registrar todo el lote
+        st.rerun()
+    st.progress(terminados / len(job['trabajos']), text=f"Procesando comprobantes ({terminados} de {len(job['trabajos'])})...")
+
+def finish_batch_upload(job):
+    """Insert the stored receipts of a finished batch in one transaction and summarize it"""
+    rows = []
+    errores = []
+    for entry, future in job['trabajos']:
+        try:
+            stored = future.result()
+        except Exception as e:
+            errores.append(f"{entry['archivo']}: {e}")
+            continue
+        rows.append(comprobante_row(entry['propiedad_id'], MESES[entry['mes_num'] - 1], entry['anio'], stored))
+    insertados = insert_comprobantes(rows) if rows else 0
+    return {'insertados': insertados, 'duplicados': len(rows) - insertados, 'errores': errores}
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class UploadGarbageCollector:
+    """Background thread that removes files in uploads/ no database row references
+
+    Deletes only touch the database; the collector reconciles the upload
+    folder against comprobantes and propiedades in batches, either when
+    woken up after a delete or every UPLOAD_GC_INTERVAL seconds.
+    """
+
+    def __init__(self, interval=UPLOAD_GC_INTERVAL):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='upload-gc', daemon=True)
+        self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.collect()
+            except Exception:
+                logger.exception("Error en la recolección de archivos subidos")
+
+    def _candidates(self, cutoff):
+        """Yield (reference, path) for every stored file older than cutoff"""
+        tmp_dirname = os.path.basename(UPLOAD_TMP_FOLDER)
+        for dirpath, dirnames, filenames in os.walk(UPLOAD_FOLDER):
+            relative_dir = os.path.relpath(dirpath, UPLOAD_FOLDER)
+            if relative_dir == os.curdir and tmp_dirname in dirnames:
+                dirnames.remove(tmp_dirname)
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
                 try:
-                    cursor.execute("INSERT INTO propiedades (propiedad_id) VALUES (?)", (i,))
-                except sqlite3.IntegrityError:
+                    if os.path.getmtime(path) > cutoff:
+                        continue
+                except FileNotFoundError:
+                    continue
+                if relative_dir == os.curdir:
+                    yield filename, path
+                else:
+                    yield '/'.join(relative_dir.split(os.sep) + [filename]), path
+        # Restos de subidas interrumpidas
+        try:
+            with os.scandir(UPLOAD_TMP_FOLDER) as it:
+                for entry in it:
+                    if entry.is_file() and entry.stat().st_mtime <= cutoff:
+                        yield None, entry.path
+        except FileNotFoundError:
+            pass
+
+    def _referenced(self, references):
+        sharded = [ref for ref in references if ref and '/' in ref]
+        legacy = [ref for ref in references if ref and '/' not in ref]
+        found = set()
+        if sharded:
+            placeholders = ', '.join('?' for _ in sharded)
+            found.update(row[0] for row in query_db(f'''
+                SELECT ruta FROM comprobantes WHERE ruta IN ({placeholders})
+                UNION
+                SELECT original_ruta FROM comprobantes WHERE original_ruta IN ({placeholders})
+                UNION
+                SELECT contrato_ruta FROM propiedades WHERE contrato_ruta IN ({placeholders})
+            ''', sharded * 3))
+        if legacy:
+            # Archivos anteriores al almacén por contenido, guardados con su nombre
+            placeholders = ', '.join('?' for _ in legacy)
+            found.update(row[0] for row in query_db(f'''
+                SELECT nombre FROM comprobantes WHERE ruta IS NULL AND nombre IN ({placeholders})
+                UNION
+                SELECT comprobante_contrato FROM propiedades WHERE contrato_ruta IS NULL AND comprobante_contrato IN ({placeholders})
+            ''', legacy + legacy))
+        return found
+
+    def collect(self):
+        """Remove unreferenced files older than the grace period and return how many"""
+        cutoff = time.time() - UPLOAD_GC_GRACE_SECONDS
+        removed = 0
+        emptied_dirs = set()
+        for batch in _batched(self._candidates(cutoff), UPLOAD_GC_BATCH_SIZE):
+            referenced = self._referenced([reference for reference, _ in batch])
+            for reference, path in batch:
+                if reference in referenced:
+                    continue
+                try:
+                    # Una subida repetida pudo renovar el archivo y registrarlo
+                    # después de listarlo: volver a comprobar antes de borrar
+                    if os.path.getmtime(path) > cutoff:
+                        continue
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
                     pass
-        db.commit()
+                if reference and '/' in reference:
+                    emptied_dirs.add(os.path.dirname(path))
+        self._prune(emptied_dirs)
+        return removed
+
+    def _prune(self, dirs):
+        """Remove the aa/bb shard directories left empty by collect"""
+        for path in sorted(dirs, reverse=True):
+            # bb y después aa; rmdir falla sin borrar nada si aún tienen archivos
+            for directory in (path, os.path.dirname(path)):
+                if os.path.normpath(directory) == os.path.normpath(UPLOAD_FOLDER):
+                    break
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break
+
+
+@st.cache_resource
+def get_upload_gc():
+    return UploadGarbageCollector()
+
+def file_server_secret():
+    """HMAC key shared by every app process serving the same data
+
+    Taken from RENTAPP_FILE_SERVER_SECRET, or else from FILE_SERVER_KEY_FILE,
+    which the first process creates.
+    """
+    if FILE_SERVER_SECRET:
+        return FILE_SERVER_SECRET.encode()
+    if not os.path.exists(FILE_SERVER_KEY_FILE):
+        # Se escribe aparte y se enlaza: si dos procesos compiten, gana uno solo
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(FILE_SERVER_KEY_FILE)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(secrets.token_bytes(32))
+            os.link(tmp_path, FILE_SERVER_KEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(FILE_SERVER_KEY_FILE, 'rb') as f:
+        return f.read()
+
+class FileServer:
+    """Small HTTP endpoint that streams stored files for download links
+
+    Links carry an HMAC-signed token with the file reference, its download
+    name and an expiry, so only files the app linked to can be fetched.
+    Responses support HEAD and single byte ranges and are sent with
+    sendfile, so nothing is loaded into the Streamlit session.
+    """
+
+    def __init__(self, host=FILE_SERVER_HOST, port=FILE_SERVER_PORT, public_url=FILE_SERVER_URL):
+        self._secret = file_server_secret()
+        try:
+            self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        except OSError:
+            if public_url:
+                # Los enlaces apuntan a la URL pública: en otro puerto nadie los atendería
+                raise
+            # Puerto ocupado (p. ej. otro proceso de la app): usar uno libre
+            self._httpd = ThreadingHTTPServer((host, 0), self._make_handler())
+        self._httpd.daemon_threads = True
+        self.public_url = (public_url or f"http://localhost:{self._httpd.server_address[1]}").rstrip('/')
+        threading.Thread(target=self._httpd.serve_forever, name='file-server', daemon=True).start()
+
+    def _sign(self, payload):
+        return hmac.new(self._secret, payload, hashlib.sha256).digest()
+
+    def url_for(self, ruta, nombre, mime):
+        # Caducidad redondeada para que los enlaces no cambien en cada rerun
+        expires = (int(time.time()) // FILE_LINK_TTL + 2) * FILE_LINK_TTL
+        payload = json.dumps([ruta, nombre, mime, expires], separators=(',', ':')).encode()
+        token = f"{base64.urlsafe_b64encode(payload).decode()}.{base64.urlsafe_b64encode(self._sign(payload)).decode()}"
+        return f"{self.public_url}/archivo/{token}"
+
+    def resolve(self, token):
+        """Return (ruta, nombre, mime) for a valid, unexpired token or None"""
+        try:
+            encoded_payload, encoded_signature = token.split('.')
+            payload = base64.urlsafe_b64decode(encoded_payload)
+            if not hmac.compare_digest(self._sign(payload), base64.urlsafe_b64decode(encoded_signature)):
+                return None
+            ruta, nombre, mime, expires = json.loads(payload)
+        except (ValueError, TypeError):
+            return None
+        if expires < time.time():
+            return None
+        return ruta, nombre, mime
+
+    def _make_handler(self):
+        file_server = self
+
+        class UploadRequestHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self._serve(send_body=True)
+
+            def do_HEAD(self):
+                self._serve(send_body=False)
+
+            def _serve(self, send_body):
+                prefix = '/archivo/'
+                resolved = file_server.resolve(self.path[len(prefix):].split('?')[0]) if self.path.startswith(prefix) else None
+                if resolved is None:
+                    self.send_error(404)
+                    return
+                ruta, nombre, mime = resolved
+                try:
+                    f = open(upload_path(ruta, nombre), 'rb')
+                except FileNotFoundError:
+                    self.send_error(404)
+                    return
+                with f:
+                    size = os.fstat(f.fileno()).st_size
+                    byte_range = _parse_range(self.headers.get('Range'), size)
+                    if byte_range is False:
+                        self.send_response(416)
+                        self.send_header('Content-Range', f"bytes */{size}")
+                        self.send_header('Content-Length', '0')
+                        self.end_headers()
+                        return
+                    start, end = byte_range or (0, size - 1)
+                    length = max(end - start + 1, 0)
+                    self.send_response(206 if byte_range else 200)
+                    if byte_range:
+                        self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+                    self.send_header('Content-Type', mime or 'application/octet-stream')
+                    self.send_header('Content-Length', str(length))
+                    self.send_header('Accept-Ranges', 'bytes')
+                    self.send_header('Content-Disposition', f"attachment; filename*=UTF-8''{quote(nombre)}")
+                    self.send_header('Cache-Control', 'private, max-age=3600')
+                    self.end_headers()
+                    if send_body and length:
+                        self.wfile.flush()
+                        self.connection.sendfile(f, offset=start, count=length)
+
+            def log_message(self, format, *args):
+                logger.debug("file-server: " + format, *args)
+
+        return UploadRequestHandler
+
+
+def _parse_range(header, size):
+    """Parse a single 'bytes=' range; None means the whole file, False is unsatisfiable"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+@st.cache_resource
+def get_file_server():
+    return FileServer()
+
+def read_upload(filepath):
+    """Read a stored file through a memory map; used as a deferred download callback"""
+    with open(filepath, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        count_profile('bytes_leidos', size)
+        if size == 0:
+            return b''
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return mapped[:]
+
+# Miniaturas para la lista de comprobantes
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+def _thumbnail_cache_path(filepath, mtime_ns, size):
+    key = hashlib.sha1(f"{os.path.abspath(filepath)}|{mtime_ns}|{size}".encode()).hexdigest()
+    return os.path.join(THUMBNAIL_FOLDER, f"{key}.jpg")
+
+def _render_pdf_first_page(filepath):
+    try:
+        import pypdfium2 as pdfium
+    except ImportError:
+        return None
+    pdf = pdfium.PdfDocument(filepath)
+    try:
+        page = pdf[0]
+        scale = max(THUMBNAIL_SIZE) / max(page.get_size())
+        return page.render(scale=scale).to_pil()
+    finally:
+        pdf.close()
+
+def _evict_thumbnails():
+    """Remove least recently used thumbnails while the cache is over budget"""
+    entries = []
+    total = 0
+    with os.scandir(THUMBNAIL_FOLDER) as it:
+        for entry in it:
+            if entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+    if total <= THUMBNAIL_CACHE_MAX_BYTES:
+        return
+    entries.sort()
+    target = THUMBNAIL_CACHE_MAX_BYTES * 0.8
+    for _, size, path in entries:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except FileNotFoundError:
+            pass
+
+def get_thumbnail(filepath, mime, mtime_ns, size):
+    """Return JPEG thumbnail bytes for an image or PDF, or None if it can't be rendered"""
+    cache_path = _thumbnail_cache_path(filepath, mtime_ns, size)
+    try:
+        with open(cache_path, 'rb') as f:
+            thumbnail_bytes = f.read()
+        os.utime(cache_path)  # marca de uso reciente para la expulsión LRU
+        count_profile('bytes_leidos', len(thumbnail_bytes))
+        return thumbnail_bytes
+    except FileNotFoundError:
+        pass
+
+    from PIL import Image, ImageOps
+
+    try:
+        if mime == 'application/pdf':
+            image = _render_pdf_first_page(filepath)
+            if image is None:
+                return None
+        elif mime.startswith('image/'):
+            image = Image.open(filepath)
+            image.draft('RGB', THUMBNAIL_SIZE)  # decodificación reducida para JPEG
+            image = ImageOps.exif_transpose(image)
+        else:
+            return None
+        image.thumbnail(THUMBNAIL_SIZE)
+        output = BytesIO()
+        image.convert('RGB').save(output, format='JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+    except Exception:
+        return None
+
+    count_profile('bytes_leidos', size)
+    count_profile('miniaturas_generadas')
+    thumbnail_bytes = output.getvalue()
+    # La caché es prescindible: si no se puede escribir, la miniatura se muestra igual
+    try:
+        os.makedirs(THUMBNAIL_FOLDER, exist_ok=True)  # la carpeta se puede borrar en cualquier momento
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(thumbnail_bytes)
+        os.replace(tmp_path, cache_path)
+        _evict_thumbnails()
+    except OSError:
+        logger.warning("No se pudo guardar la miniatura en la caché", exc_info=True)
+    return thumbnail_bytes
+
+@st.cache_data(max_entries=2000, show_spinner=False)
+def get_thumbnail_html(filepath, mime, mtime_ns, size):
+    thumbnail_bytes = get_thumbnail(filepath, mime, mtime_ns, size)
+    if thumbnail_bytes is None:
+        return None
+    encoded_string = base64.b64encode(thumbnail_bytes).decode()
+    count_profile('bytes_base64', len(encoded_string))
+    return f'<img src="data:image/jpeg;base64,{encoded_string}" width="{THUMBNAIL_DISPLAY_WIDTH}">'
 
-setup_database()
 
 class ReportGenerator:
     def __init__(self, database):
         self.database = database
 
-    def generate_tenant_report(self):
-        """Generate a comprehensive tenant report"""
-        propiedades = query_db('SELECT * FROM propiedades ORDER BY propiedad_id')
+    def _fetch_report_rows(self, progress_callback=None):
+        """Stream properties with their payment summary from a single aggregated query"""
+        anio_actual = datetime.now().year
+        with read_snapshot() as conn:
+            total = conn.execute('SELECT COUNT(*) FROM propiedades').fetchone()[0]
+            cursor = conn.execute('''
+                SELECT p.propiedad_id, p.valor_renta, p.arrendatario, p.fecha_inicio,
+                       COUNT(c.id) AS num_comprobantes,
+                       SUM(c.anio = ?) AS comprobantes_anio,
+                       MAX(c.anio * 100 + c.mes_num) AS ultimo_periodo
+                FROM propiedades p
+                LEFT JOIN comprobantes c ON c.propiedad_id = p.propiedad_id
+                GROUP BY p.propiedad_id
+                ORDER BY p.propiedad_id
+            ''', (anio_actual,))
+            for i, propiedad in enumerate(cursor, start=1):
+                ultimo_periodo = propiedad['ultimo_periodo']
+                yield [
+                    str(propiedad['propiedad_id']),
+                    propiedad['arrendatario'] if propiedad['arrendatario'] else 'Vacante',
+                    f"{propiedad['valor_renta']:.2f}" if propiedad['valor_renta'] is not None else 'N/A',
+                    propiedad['fecha_inicio'] if propiedad['fecha_inicio'] else 'N/A',
+                    str(propiedad['num_comprobantes']),
+                    str(propiedad['comprobantes_anio'] or 0),
+                    f"{MESES[ultimo_periodo % 100 - 1]} {ultimo_periodo // 100}" if ultimo_periodo else 'Sin pagos',
+                ]
+                if progress_callback and i % REPORT_TABLE_CHUNK == 0:
+                    progress_callback(0.5 * i / max(total, 1))
+
+    def generate_tenant_report(self, progress_callback=None):
+        """Generate a comprehensive tenant report
+
+        Properties are laid out as table rows (split in chunks so ReportLab
+        doesn't have to split one huge table across pages) together with a
+        summary of the receipts uploaded for each one.
+        """
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import letter
+        from reportlab.lib.styles import getSampleStyleSheet
+        from reportlab.lib.units import inch
+        from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
         output = BytesIO()
         doc = SimpleDocTemplate(output, pagesize=letter)
         story = []
@@ -101,19 +1560,107 @@ class ReportGenerator:
         story.append(Paragraph("Informe de Inquilinos", styles['Title']))
         story.append(Spacer(1, 0.2*inch))
 
-        for propiedad in propiedades:
-            story.append(Paragraph(f"Propiedad {propiedad['propiedad_id']}", styles['h2']))
-            story.append(Spacer(1, 0.1*inch))
-            story.append(Paragraph(f"Valor Renta: {propiedad['valor_renta'] if propiedad['valor_renta'] is not None else 'N/A'}", styles['Normal']))
-            story.append(Paragraph(f"Arrendatario: {propiedad['arrendatario'] if propiedad['arrendatario'] else 'Vacante'}", styles['Normal']))
-            story.append(Paragraph(f"Fecha Inicio: {propiedad['fecha_inicio'] if propiedad['fecha_inicio'] else 'N/A'}", styles['Normal']))
-            story.append(Spacer(1, 0.2*inch))
-
-        doc.build(story)
+        header = ['Propiedad', 'Arrendatario', 'Valor Renta', 'Fecha Inicio', 'Comprobantes', f'Pagos {datetime.now().year}', 'Último pago']
+        table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
+            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+            ('FONTSIZE', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ])
+        col_widths = [0.8*inch, 1.9*inch, 0.9*inch, 0.9*inch, 0.9*inch, 0.8*inch, 1.0*inch]
+
+        rows = []
+        for row in self._fetch_report_rows(progress_callback):
+            rows.append(row)
+            if len(rows) == REPORT_TABLE_CHUNK:
+                story.append(Table([header] + rows, colWidths=col_widths, repeatRows=1, style=table_style))
+                rows = []
+        if rows or not story[2:]:
+            story.append(Table([header] + rows, colWidths=col_widths, repeatRows=1, style=table_style))
+
+        if progress_callback:
+            # La segunda mitad del progreso corresponde a la maquetación del PDF
+            size_estimate = {'total': 1}
+
+            def on_build_progress(typ, value):
+                if typ == 'SIZE_EST':
+                    size_estimate['total'] = max(value, 1)
+                elif typ == 'PROGRESS':
+                    progress_callback(0.5 + 0.5 * min(value / size_estimate['total'], 1.0))
+            doc.setProgressCallBack(on_build_progress)
+
+        with profiled('doc.build'):
+            doc.build(story)
         output.seek(0)
         return output
 
 
+class ReportJob:
+    """A tenant report being generated in the background for one data version"""
+
+    def __init__(self, version):
+        self.version = version
+        self.progress = 0.0
+        self.future = None
+
+    def set_progress(self, value):
+        self.progress = value
+
+    def done(self):
+        return self.future.done()
+
+
+class ReportService:
+    """Runs report generation off the script thread and caches the result per data version"""
+
+    def __init__(self, database):
+        self.database = database
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def get(self, version):
+        with self._lock:
+            return self._jobs.get(version)
+
+    def submit(self, version, profile=False):
+        with self._lock:
+            job = self._jobs.get(version)
+            # Un informe que falló (p. ej. base bloqueada) se puede volver a pedir
+            if job is not None and not (job.done() and job.future.exception() is not None):
+                return job
+            job = ReportJob(version)
+            job.future = self._executor.submit(self._generate, job, profile)
+            self._jobs[version] = job
+            # Solo se conservan los informes de las versiones más recientes
+            for old_version in sorted(self._jobs)[:-REPORT_CACHE_VERSIONS]:
+                del self._jobs[old_version]
+            return job
+
+    def _generate(self, job, profile=False):
+        with profiling('informe', enabled=profile):
+            pdf_bytes = ReportGenerator(self.database).generate_tenant_report(job.set_progress).getvalue()
+        job.set_progress(1.0)
+        return pdf_bytes
+
+
+@st.cache_resource
+def get_report_service():
+    return ReportService(DATABASE)
+
+@st.fragment(run_every=1)
+def report_progress(version):
+    job = get_report_service().get(version)
+    if job is None or job.done():
+        # Rerun completo para mostrar el botón de descarga fuera del fragmento
+        st.rerun()
+    st.progress(job.progress, text="Generando informe...")
+
+
+init_database()
+
+
 # Función principal de la aplicación
 def main():
     if st.session_state.get('selected_propiedad') is not None:
@@ -125,45 +1672,98 @@ def main():
         st.session_state['selected_propiedad'] = None
 
     if st.session_state['selected_propiedad'] is None:
+        import altair as alt
+
         st.title("Control rentas - inquilinos")
 
-        propiedades = query_db('SELECT * FROM propiedades ORDER BY propiedad_id')
+        # Un lote terminado se registra antes de leer la versión de los datos
+        # para que toda la página refleje ya los comprobantes nuevos
+        carga = st.session_state.get('carga_masiva')
+        if carga is not None and all(future.done() for _, future in carga['trabajos']):
+            del st.session_state['carga_masiva']
+            try:
+                st.session_state['carga_masiva_resultado'] = finish_batch_upload(carga)
+            except Exception as e:
+                st.session_state['carga_masiva_resultado'] = {'insertados': 0, 'duplicados': 0, 'errores': [f"Error al guardar los comprobantes: {e}"]}
+            # Una clave nueva vacía el selector de archivos
+            st.session_state['carga_masiva_widget'] = st.session_state.get('carga_masiva_widget', 0) + 1
+
+        data_version = get_data_version()
+        with profiled('cargar_propiedades'):
+            propiedades = load_propiedades(data_version)
+
+        busqueda = st.text_input(
+            "Buscar",
+            key="busqueda_propiedades",
+            placeholder="Inquilino, número de propiedad, o nombre, mes o año de un comprobante",
+        )
+        # Paginación por conjunto de claves; una búsqueda nueva vuelve a la primera página
+        if st.session_state.get('propiedades_busqueda') != busqueda:
+            st.session_state['propiedades_busqueda'] = busqueda
+            st.session_state['propiedades_cursores'] = [None]
+        cursores = st.session_state['propiedades_cursores']
+        with profiled('buscar_propiedades'):
+            pagina, next_cursor = search_propiedades(data_version, busqueda, cursores[-1])
+        if not pagina and len(cursores) > 1:
+            cursores.pop()
+            st.rerun()
 
-        cols = st.columns(3)
-        for i, propiedad in enumerate(propiedades):
-            with cols[i % 3]:
-                st.subheader(f"Propiedad {propiedad['propiedad_id']}")
+        with profiled('grilla_propiedades'):
+            if not pagina:
+                st.info("Ninguna propiedad coincide con la búsqueda." if busqueda else "No hay propiedades.")
+            cols = st.columns(3)
+            for i, propiedad in enumerate(pagina):
+                with cols[i % 3]:
+                    st.subheader(f"Propiedad {propiedad['propiedad_id']}")
 
-                ocupada = propiedad['arrendatario'] is not None and propiedad['arrendatario'] != ''
+                    if propiedad['ocupada']:
+                        st.markdown(f'<p style="margin-top: -10px; margin-bottom: 10px; color:red;">Ocupada</p>', unsafe_allow_html=True)
+                    else:
+                        st.markdown(f'<p style="margin-top: -10px; margin-bottom: 10px; color:green;">Disponible</p>', unsafe_allow_html=True)
 
-                if ocupada:
-                    st.markdown(f'<p style="margin-top: -10px; margin-bottom: 10px; color:red;">Ocupada</p>', unsafe_allow_html=True)
-                else:
-                    st.markdown(f'<p style="margin-top: -10px; margin-bottom: 10px; color:green;">Disponible</p>', unsafe_allow_html=True)
+                    if st.button("Ver Detalles", key=f"propiedad_{propiedad['propiedad_id']}"):
+                        st.session_state['selected_propiedad'] = propiedad['propiedad_id']
+                        st.rerun()
 
-                if st.button("Ver Detalles", key=f"propiedad_{propiedad['propiedad_id']}"):
-                    st.session_state['selected_propiedad'] = propiedad['propiedad_id']
+        if len(cursores) > 1 or next_cursor is not None:
+            col_prev, col_page, col_next = st.columns(3)
+            with col_prev:
+                if st.button("Anterior", key="propiedades_prev", disabled=len(cursores) == 1):
+                    cursores.pop()
+                    st.rerun()
+            with col_page:
+                st.write(f"Página {len(cursores)}")
+            with col_next:
+                if st.button("Siguiente", key="propiedades_next", disabled=next_cursor is None):
+                    cursores.append(next_cursor)
                     st.rerun()
 
         st.subheader("Informes")
-        if st.button("Generar Informe de Inquilinos"):
-            report_generator = ReportGenerator(DATABASE)
-            pdf_bytes = report_generator.generate_tenant_report().getvalue()
+        report_job = get_report_service().get(data_version)
+        report_failed = report_job is not None and report_job.done() and report_job.future.exception() is not None
+        if report_failed:
+            st.error(f"Error al generar el informe: {report_job.future.exception()}")
+        if report_job is None or report_failed:
+            if st.button("Generar Informe de Inquilinos"):
+                get_report_service().submit(data_version, profile=profiling_enabled())
+                st.rerun()
+        elif not report_job.done():
+            report_progress(data_version)
+        else:
+            # El PDF se entrega solo al pulsar el botón, no en cada rerun
             st.download_button(
                 label="Descargar Informe",
-                data=pdf_bytes,
+                data=report_job.future.result,
                 file_name='informe_inquilinos.pdf',
                 mime='application/pdf',
             )
         st.subheader("Gráfico de Valores de Renta")
-        propiedades_data = query_db('SELECT propiedad_id, valor_renta FROM propiedades ORDER BY propiedad_id')
-        chart_data = []
-        for propiedad in propiedades_data:
-            if propiedad['valor_renta'] is not None and propiedad['valor_renta'] > 0:
-                chart_data.append({"Propiedad": str(propiedad['propiedad_id']), "Valor Renta": propiedad['valor_renta']})
-            else:
-                chart_data.append({"Propiedad": str(propiedad['propiedad_id']), "Valor Renta": 0, "Estado": "Disponible"})
-        df = pd.DataFrame(chart_data)
+        con_renta = propiedades['valor_renta'].fillna(0) > 0
+        df = pd.DataFrame({
+            "Propiedad": propiedades['propiedad_id'].astype(str),
+            "Valor Renta": propiedades['valor_renta'].where(con_renta, 0),
+            "Estado": pd.Series("Disponible", index=propiedades.index).where(~con_renta),
+        })
         chart = alt.Chart(df).mark_bar().encode(
             x=alt.X('Propiedad:O', title='Propiedad'),
             y=alt.Y('Valor Renta:Q',
@@ -173,12 +1773,71 @@ def main():
         ).properties(
             title='Valores de Renta por propiedad'
         )
-        st.altair_chart(chart, use_container_width=True)
+        with profiled('grafico_rentas'):
+            st.altair_chart(chart, use_container_width=True)
+
+        st.subheader("Pagos y morosidad")
+        with profiled('cargar_morosidad'):
+            ledger = get_ledger(data_version, current_periodo())
+        morosos = ledger.arrears()
+        col_morosos, col_monto = st.columns(2)
+        col_morosos.metric("Propiedades con pagos pendientes", len(morosos))
+        col_monto.metric("Monto adeudado", f"{morosos['monto_adeudado'].sum():,.2f}")
+        heatmap = alt.Chart(ledger.heatmap_frame()).mark_rect().encode(
+            x=alt.X('Periodo:O', title='Mes'),
+            y=alt.Y('Propiedad:O', title='Propiedad', sort=None),
+            color=alt.Color('Estado:N', scale=alt.Scale(domain=['Pagado', 'Adeudado', 'Sin contrato'], range=['#4caf50', '#e53935', '#eeeeee'])),
+            tooltip=['Propiedad', 'Periodo', 'Estado'],
+        ).properties(
+            title=f'Pagos de los últimos {HEATMAP_MESES} meses'
+        )
+        with profiled('mapa_calor'):
+            st.altair_chart(heatmap, use_container_width=True)
+        if not morosos.empty:
+            with st.expander("Detalle de pagos pendientes"):
+                detalle = morosos.head(HEATMAP_MAX_PROPIEDADES).copy()
+                detalle['meses'] = [', '.join(ledger.unpaid_periods(propiedad_id)) for propiedad_id in detalle['propiedad_id']]
+                st.dataframe(detalle, hide_index=True, use_container_width=True)
+
+        st.subheader("Carga masiva de comprobantes")
+        resultado = st.session_state.pop('carga_masiva_resultado', None)
+        if resultado is not None:
+            st.success(f"{resultado['insertados']} comprobantes importados.")
+            if resultado['duplicados']:
+                st.info(f"{resultado['duplicados']} comprobantes ya existían y se omitieron.")
+            for error in resultado['errores']:
+                st.error(error)
+        if st.session_state.get('carga_masiva') is not None:
+            batch_upload_progress('carga_masiva')
+        else:
+            st.caption("El nombre de cada archivo indica la propiedad, el mes y el año, p. ej. p12_2024-03.pdf o 12_Marzo_2024.jpg.")
+            origen_carga = st.radio("Origen", ["Archivos o zip", "Carpeta"], horizontal=True, key="carga_masiva_origen")
+            widget = st.session_state.get('carga_masiva_widget', 0)
+            tipos = [extension.lstrip('.') for extension in RECEIPT_EXTENSIONS]
+            if origen_carga == "Carpeta":
+                archivos = st.file_uploader("Seleccionar carpeta", type=tipos, accept_multiple_files="directory", key=f"carga_masiva_carpeta_{widget}")
+            else:
+                archivos = st.file_uploader("Seleccionar comprobantes", type=tipos + ['zip'], accept_multiple_files=True, key=f"carga_masiva_archivos_{widget}")
+            if archivos:
+                entries = batch_upload_entries(archivos, set(propiedades['propiedad_id'].tolist()))
+                listos = [entry for entry in entries if entry['estado'] == "Listo"]
+                st.dataframe(pd.DataFrame({
+                    "Archivo": [entry['archivo'] for entry in entries],
+                    "Propiedad": [entry['propiedad_id'] for entry in entries],
+                    "Mes": [MESES[entry['mes_num'] - 1] if entry['mes_num'] else None for entry in entries],
+                    "Año": [entry['anio'] for entry in entries],
+                    "Estado": [entry['estado'] for entry in entries],
+                }), hide_index=True, use_container_width=True)
+                if st.button(f"Importar {len(listos)} comprobantes", disabled=not listos, key="carga_masiva_importar"):
+                    executor = get_upload_executor()
+                    st.session_state['carga_masiva'] = {
+                        'trabajos': [(entry, executor.submit(prepare_batch_entry, entry)) for entry in listos],
+                    }
+                    st.rerun()
         st.markdown("---")
 
         st.subheader("Eliminar propiedad")
-        propiedades = query_db('SELECT propiedad_id FROM propiedades ORDER BY propiedad_id')
-        propiedad_ids = [s['propiedad_id'] for s in propiedades] if propiedades else []
+        propiedad_ids = propiedades['propiedad_id'].tolist()
         propiedad_to_delete = st.selectbox("Seleccione la propiedad a eliminar:", propiedad_ids, key="delete_propiedad_selectbox")
 
         if st.button("Eliminar propiedad"):
@@ -187,27 +1846,10 @@ def main():
                     st.warning(f"¿Está seguro de que desea eliminar la propiedad {propiedad_to_delete}? Confirme nuevamente.")
                     st.session_state['confirm_delete'] = propiedad_to_delete
                 else:
-                    associated_comprobantes = query_db("SELECT id, nombre FROM comprobantes WHERE propiedad_id = ?", (propiedad_to_delete,))
-                    for comp in associated_comprobantes:
-                        filepath_to_delete = os.path.join(UPLOAD_FOLDER, comp['nombre'])
-                        if os.path.exists(filepath_to_delete):
-                            try:
-                                os.remove(filepath_to_delete)
-                            except Exception as e:
-                                st.error(f"Error al eliminar archivo asociado {comp['nombre']}: {e}")
-                    execute_db("DELETE FROM comprobantes WHERE propiedad_id = ?", (propiedad_to_delete,))
-
-                    propiedad_data_to_delete = query_db("SELECT comprobante_contrato FROM propiedades WHERE propiedad_id = ?", (propiedad_to_delete,), one=True)
-                    if propiedad_data_to_delete and propiedad_data_to_delete['comprobante_contrato']:
-                         contract_filepath_to_delete = os.path.join(UPLOAD_FOLDER, propiedad_data_to_delete['comprobante_contrato'])
-                         if os.path.exists(contract_filepath_to_delete):
-                              try:
-                                   os.remove(contract_filepath_to_delete)
-                              except Exception as e:
-                                   st.error(f"Error al eliminar archivo de contrato asociado {propiedad_data_to_delete['comprobante_contrato']}: {e}")
-
-
+                    # Los comprobantes se eliminan en cascada en la misma transacción;
+                    # el recolector borra después los archivos que quedaron sin referencia
                     execute_db("DELETE FROM propiedades WHERE propiedad_id = ?", (propiedad_to_delete,))
+                    get_upload_gc().wake()
                     st.success(f"Propiedad {propiedad_to_delete} y sus registros asociados eliminados.")
                     st.session_state['confirm_delete'] = None
                     st.session_state['selected_propiedad'] = None
@@ -218,9 +1860,7 @@ def main():
 
         st.subheader("Agregar propiedad")
         if st.button("Agregar propiedad"):
-            max_propiedad = query_db("SELECT MAX(propiedad_id) as max_id FROM propiedades", one=True)
-            new_propiedad_id = (max_propiedad['max_id'] or 0) + 1
-            execute_db("INSERT INTO propiedades (propiedad_id) VALUES (?)", (new_propiedad_id,))
+            new_propiedad_id = add_propiedad()
             st.success(f"Propiedad {new_propiedad_id} agregada")
             st.rerun()
     else:
@@ -246,15 +1886,14 @@ def main():
             st.subheader("Contrato:")
             if propiedad_data['comprobante_contrato']:
                 contract_filename = propiedad_data['comprobante_contrato']
-                contract_filepath = os.path.join(UPLOAD_FOLDER, contract_filename)
+                contract_filepath = upload_path(propiedad_data['contrato_ruta'], contract_filename)
                 if os.path.exists(contract_filepath):
-                    with open(contract_filepath, "rb") as f:
-                        contract_bytes = f.read()
+                    # El contrato solo se lee del disco cuando se pulsa el botón
                     st.download_button(
                         label="Descargar Contrato",
-                        data=contract_bytes,
+                        data=functools.partial(read_upload, contract_filepath),
                         file_name=contract_filename,
-                        mime="application/octet-stream",
+                        mime=propiedad_data['contrato_mime'] or "application/octet-stream",
                         key=f"download_contract_{propiedad_id}"
                     )
                 else:
@@ -287,19 +1926,19 @@ def main():
                         if arrendatario and not re.match('^[a-zA-ZñÑáéíóúÁÉÍÓÚ\s]+$', arrendatario):
                             st.error('Solo letras y espacios en el nombre del arrendatario.')
                         else:
-                            contract_filename = propiedad_data['comprobante_contrato']
+                            contract = {
+                                'nombre': propiedad_data['comprobante_contrato'],
+                                'ruta': propiedad_data['contrato_ruta'],
+                                'sha256': propiedad_data['contrato_sha256'],
+                                'tamano': propiedad_data['contrato_tamano'],
+                                'mime': propiedad_data['contrato_mime'],
+                            }
                             if uploaded_contract_file is not None:
                                 try:
-                                    filename = secure_filename(uploaded_contract_file.name)
-                                    filepath = os.path.join(UPLOAD_FOLDER, filename)
-                                    with open(filepath, "wb") as f:
-                                        f.write(uploaded_contract_file.getbuffer())
-                                    contract_filename = filename
+                                    contract = store_upload(uploaded_contract_file, uploaded_contract_file.name)
                                     st.success("Archivo de contrato subido exitosamente.")
                                 except Exception as e:
                                     st.error(f"Error al subir el archivo de contrato: {e}")
-                                    contract_filename = propiedad_data['comprobante_contrato']
-
 
                             execute_db('''
                                 UPDATE propiedades
@@ -308,9 +1947,16 @@ def main():
                                     fecha_inicio = ?,
                                     garantia = ?,
                                     monto_deposito = ?,
-                                    comprobante_contrato = ?
+                                    comprobante_contrato = ?,
+                                    contrato_ruta = ?,
+                                    contrato_sha256 = ?,
+                                    contrato_tamano = ?,
+                                    contrato_mime = ?
                                 WHERE propiedad_id = ?
-                            ''', (valor_renta, arrendatario, fecha_inicio.strftime('%Y-%m-%d') if fecha_inicio else None, int(garantia), monto_deposito, contract_filename, propiedad_id))
+                            ''', (valor_renta, arrendatario, fecha_inicio.strftime('%Y-%m-%d') if fecha_inicio else None, int(garantia), monto_deposito,
+                                  contract['nombre'], contract['ruta'], contract['sha256'], contract['tamano'], contract['mime'], propiedad_id))
+                            if propiedad_data['comprobante_contrato'] and propiedad_data['contrato_ruta'] != contract['ruta']:
+                                get_upload_gc().wake()
                             st.success("Datos de la propiedad actualizados")
                             st.session_state['confirm_edit'] = False
                             st.rerun()
@@ -321,81 +1967,90 @@ def main():
         st.write("Subir nuevo comprobante:")
         # --- MODIFIED: File uploader and separate save button ---
         uploaded_file = st.file_uploader("Seleccionar archivo", type=["png", "jpg", "jpeg", "pdf"], key=f"uploader_{propiedad_id}")
-        mes_pago = st.selectbox("Mes", ["Enero", "Febrero", "Marzo", "Abril", "Mayo", "Junio", "Julio", "Agosto", "Septiembre", "Octubre", "Noviembre", "Diciembre"], key=f"mes_{propiedad_id}")
+        mes_pago = st.selectbox("Mes", MESES, key=f"mes_{propiedad_id}")
         anio_pago = st.number_input("Año", min_value=2000, max_value=2030, value=datetime.now().year, key=f"anio_{propiedad_id}")
 
-        # Only show save button if a file is uploaded
-        if uploaded_file is not None:
+        # La normalización y el guardado corren en el pool de subidas; el
+        # fragmento consulta el trabajo y el comprobante se registra al terminar
+        upload_job_key = f"upload_job_{propiedad_id}"
+        upload_job = st.session_state.get(upload_job_key)
+        if upload_job is not None and not upload_job['future'].done():
+            upload_progress(upload_job_key)
+        elif upload_job is not None:
+            del st.session_state[upload_job_key]
+            mes_pago, anio_pago = upload_job['mes'], upload_job['anio']
+            try:
+                stored = upload_job['future'].result()
+                filename = stored['nombre']
+                if insert_comprobantes([comprobante_row(propiedad_id, mes_pago, anio_pago, stored)]):
+                    st.success("Comprobante guardado")
+                else:
+                    st.info(f"Un comprobante con el mismo contenido que '{filename}' para {mes_pago} {anio_pago} ya existe para esta propiedad.")
+            except Exception as e:
+                st.error(f"Error al guardar el comprobante: {e}")
+        elif uploaded_file is not None:
             if st.button("Guardar Comprobante", key=f"save_comprobante_{propiedad_id}"):
-                try:
-                    filename = secure_filename(uploaded_file.name)
-                    filepath = os.path.join(UPLOAD_FOLDER, filename)
-
-                    existing_comprobante = query_db("SELECT id FROM comprobantes WHERE propiedad_id = ? AND nombre = ? AND mes = ? AND anio = ?", (propiedad_id, filename, mes_pago, anio_pago), one=True)
-
-                    if existing_comprobante is None:
-                        with open(filepath, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-
-                        execute_db('INSERT INTO comprobantes (propiedad_id, nombre, mes, anio) VALUES (?, ?, ?, ?)', (propiedad_id, filename, mes_pago, anio_pago))
-                        st.success("Comprobante guardado")
-
-                        # --- No explicit state clearing needed here with the button approach ---
-                        st.rerun()
-                    else:
-                        st.info(f"Un comprobante con el nombre '{filename}' para {mes_pago} {anio_pago} ya existe para esta propiedad.")
-                        # --- No explicit state clearing needed here ---
-                        st.rerun()
-
-
-                except Exception as e:
-                    st.error(f"Error al guardar el comprobante: {e}")
-                    # --- No explicit state clearing needed here ---
-                    st.rerun()
-
-
-        comprobantes = query_db('''
-            SELECT * FROM comprobantes
-            WHERE propiedad_id = ?
-            ORDER BY anio DESC,
-                     CASE mes
-                         WHEN "Enero" THEN 1
-                         WHEN "Febrero" THEN 2
-                         WHEN "Marzo" THEN 3
-                         WHEN "Abril" THEN 4
-                         WHEN "Mayo" THEN 5
-                         WHEN "Junio" THEN 6
-                         WHEN "Julio" THEN 7
-                         WHEN "Agosto" THEN 8
-                         WHEN "Septiembre" THEN 9
-                         WHEN "Octubre" THEN 10
-                         WHEN "Noviembre" THEN 11
-                         WHEN "Diciembre" THEN 12
-                     END DESC
-        ''', (propiedad_id,))
+                st.session_state[upload_job_key] = {
+                    'future': get_upload_executor().submit(prepare_upload, uploaded_file, uploaded_file.name),
+                    'nombre': uploaded_file.name,
+                    'mes': mes_pago,
+                    'anio': anio_pago,
+                }
+                st.rerun()
+
+
+        # Paginación por conjunto de claves: una pila de cursores por propiedad
+        cursores_key = f"comprobantes_cursores_{propiedad_id}"
+        if cursores_key not in st.session_state:
+            st.session_state[cursores_key] = [None]
+        cursores = st.session_state[cursores_key]
+        with profiled('cargar_comprobantes'):
+            comprobantes, next_cursor = get_comprobantes_page(propiedad_id, cursores[-1])
+        if not comprobantes and len(cursores) > 1:
+            # La página actual quedó vacía (p. ej. tras eliminar): volver a la anterior
+            cursores.pop()
+            st.rerun()
 
         data = []
 
         if comprobantes:
             st.subheader("Comprobantes Subidos")
+            # Los enlaces firmados solo sirven si el navegador llega al servidor de
+            # archivos; sin URL pública, las descargas van por botones de Streamlit
+            file_server = get_file_server() if FILE_SERVER_URL else None
+            download_buttons = []
             for comprobante in comprobantes:
-                filepath = os.path.join(UPLOAD_FOLDER, comprobante['nombre'])
+                filepath = upload_path(comprobante['ruta'], comprobante['nombre'])
+                mime = comprobante['mime'] or guess_mime(comprobante['nombre'])
 
                 if os.path.exists(filepath):
+                    file_stat = os.stat(filepath)
+                    with profiled('miniaturas'):
+                        thumbnail_html = get_thumbnail_html(filepath, mime, file_stat.st_mtime_ns, file_stat.st_size)
                     file_extension = os.path.splitext(comprobante['nombre'])[1].lower()
-                    if file_extension in ['.png', '.jpg', '.jpeg']:
-                        with open(filepath, "rb") as image_file:
-                            encoded_string = base64.b64encode(image_file.read()).decode()
-                        file_preview_html = f'<img src="data:image/png;base64,{encoded_string}" width="100">'
-                        download_link_html = f'<a href="data:image/png;base64,{encoded_string}" download="{comprobante["nombre"]}">Descargar</a>'
+                    if file_extension in IMAGE_EXTENSIONS:
+                        file_preview_html = thumbnail_html or "Imagen"
+                        download_label = "Descargar"
                     elif file_extension == '.pdf':
-                        with open(filepath, "rb") as pdf_file:
-                            pdf_bytes = pdf_file.read()
-                        file_preview_html = "PDF"
-                        download_link_html = f'<a href="data:application/pdf;base64,{base64.b64encode(pdf_bytes).decode()}" download="{comprobante["nombre"]}">Descargar PDF</a>'
+                        file_preview_html = thumbnail_html or "PDF"
+                        download_label = "Descargar PDF"
                     else:
                          file_preview_html = "Tipo de archivo no soportado"
-                         download_link_html = "Descargar Archivo"
+                         download_label = "Descargar Archivo"
+                    if file_server is not None:
+                        download_url = file_server.url_for(comprobante['ruta'], comprobante['nombre'], mime)
+                        download_link_html = f'<a href="{download_url}" download="{comprobante["nombre"]}">{download_label}</a>'
+                        if comprobante['original_ruta']:
+                            original_url = file_server.url_for(comprobante['original_ruta'], comprobante['original_nombre'], comprobante['original_mime'])
+                            download_link_html += f' · <a href="{original_url}" download="{comprobante["original_nombre"]}">Original</a>'
+                    else:
+                        download_link_html = "Ver botones abajo"
+                        download_buttons.append((f"{download_label} (ID {comprobante['id']})", filepath, comprobante['nombre'], mime, f"download_comprobante_{comprobante['id']}"))
+                        if comprobante['original_ruta']:
+                            download_buttons.append((
+                                f"Original (ID {comprobante['id']})", upload_path(comprobante['original_ruta']),
+                                comprobante['original_nombre'], comprobante['original_mime'], f"download_original_{comprobante['id']}",
+                            ))
 
                     data.append({
                         "ID": comprobante['id'],
@@ -412,7 +2067,32 @@ def main():
                     })
 
             df_comprobantes = pd.DataFrame(data)
-            st.write(df_comprobantes[['ID', 'Mes / Año', 'Previsualización', 'Descargar']].to_html(escape=False, index=False), unsafe_allow_html=True)
+            with profiled('tabla_comprobantes'):
+                st.write(df_comprobantes[['ID', 'Mes / Año', 'Previsualización', 'Descargar']].to_html(escape=False, index=False), unsafe_allow_html=True)
+            if download_buttons:
+                # Como el contrato: el archivo solo se lee del disco al pulsar el botón
+                button_cols = st.columns(4)
+                for i, (label, path, nombre, button_mime, key) in enumerate(download_buttons):
+                    with button_cols[i % 4]:
+                        st.download_button(
+                            label=label,
+                            data=functools.partial(read_upload, path),
+                            file_name=nombre,
+                            mime=button_mime or "application/octet-stream",
+                            key=key,
+                        )
+
+            col_prev, col_page, col_next = st.columns(3)
+            with col_prev:
+                if st.button("Anterior", key=f"comprobantes_prev_{propiedad_id}", disabled=len(cursores) == 1):
+                    cursores.pop()
+                    st.rerun()
+            with col_page:
+                st.write(f"Página {len(cursores)}")
+            with col_next:
+                if st.button("Siguiente", key=f"comprobantes_next_{propiedad_id}", disabled=next_cursor is None):
+                    cursores.append(next_cursor)
+                    st.rerun()
 
 
             st.subheader("Eliminar Comprobante por ID")
@@ -421,16 +2101,8 @@ def main():
 
             if st.button("Confirmar Eliminación"):
                 if comprobante_to_delete_id is not None:
-                    comprobante_data_to_delete = query_db("SELECT nombre FROM comprobantes WHERE id = ?", (comprobante_to_delete_id,), one=True)
-                    if comprobante_data_to_delete and comprobante_data_to_delete['nombre']:
-                        filepath_to_delete = os.path.join(UPLOAD_FOLDER, comprobante_data_to_delete['nombre'])
-                        if os.path.exists(filepath_to_delete):
-                            try:
-                                os.remove(filepath_to_delete)
-                            except Exception as e:
-                                st.error(f"Error al eliminar el archivo {comprobante_data_to_delete['nombre']}: {e}")
-
                     execute_db("DELETE FROM comprobantes WHERE id = ?", (comprobante_to_delete_id,))
+                    get_upload_gc().wake()
                     st.success(f"Comprobante con ID {comprobante_to_delete_id} eliminado de la base de datos.")
                     st.rerun()
                 else:
@@ -440,4 +2112,7 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with profiling('rerun', enabled=profiling_enabled()) as profile:
+        main()
+        if profile is not None:
+            render_profile_panel(profile)
\ No newline at end of file
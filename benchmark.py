@@ -0,0 +1,361 @@
+"""Benchmarks of the app's hot paths on a synthetic portfolio
+
+    python benchmark.py generate bench_data --propiedades 10000 --comprobantes 1000000
+    python benchmark.py run bench_data --output resultados.json
+    python benchmark.py compare base.json resultados.json
+
+`generate` builds a reproducible dataset (database.db plus real image and
+PDF receipts in uploads/) from a seed. `run` works on a hard-linked copy of
+that dataset and times a home page rerun, a property detail page with a
+long receipt history, the tenant report and a property delete, the page
+ones headlessly through Streamlit's AppTest. Results are written as JSON
+so they can be compared between commits.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import streamlit.logger
+
+# app.py se importa fuera de `streamlit run`: silenciar los avisos de modo "bare"
+streamlit.logger.set_log_level('error')
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(REPO_DIR, 'app.py')
+DATASET_INFO = 'dataset.json'
+APPTEST_TIMEOUT = 600
+
+
+@contextmanager
+def working_directory(path):
+    """app.py resolves database.db, uploads/ and thumbnails/ relative to the cwd"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def import_app():
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import app
+    return app
+
+
+# Generación del conjunto de datos
+def _receipt_image(rng, width, height):
+    from PIL import Image, ImageDraw
+
+    # Ruido de baja resolución ampliado: comprime como una foto, no como un color plano
+    noise = Image.frombytes('RGB', (width // 8, height // 8), rng.randbytes((width // 8) * (height // 8) * 3))
+    image = noise.resize((width, height), Image.BILINEAR)
+    draw = ImageDraw.Draw(image)
+    for line in range(12):
+        draw.text((width // 10, height // 10 + line * height // 16), f"Recibo {rng.randint(1000, 9999)} - ${rng.randint(300, 2000)}", fill='black')
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    output.seek(0)
+    return output
+
+
+def _receipt_pdf(rng, pages):
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    output = io.BytesIO()
+    pdf = canvas.Canvas(output, pagesize=letter)
+    for _ in range(pages):
+        for line in range(40):
+            pdf.drawString(72, 720 - line * 16, f"Comprobante de pago {rng.randint(100000, 999999)} por ${rng.randint(300, 2000)}")
+        pdf.showPage()
+    pdf.save()
+    output.seek(0)
+    return output
+
+
+def generate(data_dir, propiedades, comprobantes, archivos, historial, seed):
+    """Create a reproducible synthetic portfolio in data_dir"""
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=False)
+    start = time.perf_counter()
+    with working_directory(data_dir):
+        app = import_app()
+
+        stored = []
+        for i in range(archivos):
+            if i % 2 == 0:
+                fileobj, nombre = _receipt_image(rng, rng.choice([1600, 2400, 3000]), rng.choice([1200, 1800, 4000])), f"foto_{i}.jpg"
+            else:
+                fileobj, nombre = _receipt_pdf(rng, rng.randint(1, 3)), f"recibo_{i}.pdf"
+            stored.append(app.store_upload(fileobj, nombre))
+
+        heavy_id = 1
+        with app.get_db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('DELETE FROM propiedades')
+            conn.executemany(
+                'INSERT INTO propiedades (propiedad_id, valor_renta, arrendatario, fecha_inicio, garantia, monto_deposito) VALUES (?, ?, ?, ?, ?, ?)',
+                (
+                    (
+                        propiedad_id,
+                        float(rng.randrange(300, 3000, 25)),
+                        f"Inquilino {propiedad_id}" if rng.random() < 0.9 else None,
+                        f"{rng.randint(2010, 2024)}-{rng.randint(1, 12):02d}-01",
+                        rng.randint(0, 1),
+                        float(rng.randrange(0, 3000, 50)),
+                    )
+                    for propiedad_id in range(1, propiedades + 1)
+                ),
+            )
+
+            def receipt_rows():
+                # Historial largo y consecutivo para la propiedad del detalle
+                anio_actual = datetime.now().year
+                periodo_final = anio_actual * 12
+                for periodo in range(periodo_final - historial, periodo_final):
+                    yield heavy_id, periodo
+                restantes = max(comprobantes - historial, 0)
+                for n in range(restantes):
+                    propiedad_id = 2 + n % max(propiedades - 1, 1) if propiedades > 1 else heavy_id
+                    yield propiedad_id, periodo_final - 1 - (n // max(propiedades - 1, 1)) % 180
+
+            def with_files(rows):
+                for n, (propiedad_id, periodo) in enumerate(rows):
+                    archivo = stored[n % len(stored)] if stored else None
+                    anio, mes_num = periodo // 12, periodo % 12 + 1
+                    yield (
+                        propiedad_id, archivo['nombre'] if archivo else f"comprobante_{n}.pdf", app.MESES[mes_num - 1], anio, mes_num,
+                        archivo and archivo['ruta'], archivo and archivo['sha256'], archivo and archivo['tamano'], archivo and archivo['mime'],
+                    )
+
+            conn.executemany(
+                'INSERT INTO comprobantes (propiedad_id, nombre, mes, anio, mes_num, ruta, sha256, tamano, mime) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                with_files(receipt_rows()),
+            )
+        with app.get_db_connection() as conn:
+            conn.execute('ANALYZE')
+
+        uploads_bytes = sum(archivo['tamano'] for archivo in {a['sha256']: a for a in stored}.values())
+        info = {
+            'seed': seed,
+            'propiedades': propiedades,
+            'comprobantes': max(comprobantes, historial),
+            'archivos': archivos,
+            'bytes_uploads': uploads_bytes,
+            'propiedad_historial': heavy_id,
+            'historial_meses': historial,
+            'generado_en_s': round(time.perf_counter() - start, 2),
+        }
+        with open(DATASET_INFO, 'w', encoding='utf-8') as f:
+            json.dump(info, f, indent=2)
+    return info
+
+
+# Ejecución de los benchmarks
+def _copy_dataset(data_dir, target):
+    """Copy the database and hard-link uploads so benchmarks can mutate them freely"""
+    os.makedirs(target, exist_ok=True)
+    source = sqlite3.connect(os.path.join(data_dir, 'database.db'))
+    destination = sqlite3.connect(os.path.join(target, 'database.db'))
+    with destination:
+        source.backup(destination)
+    source.close()
+    destination.close()
+
+    def link_or_copy(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+    shutil.copytree(os.path.join(data_dir, 'uploads'), os.path.join(target, 'uploads'), copy_function=link_or_copy)
+
+
+def _summary(samples_ms):
+    ordered = sorted(samples_ms)
+    return {
+        'runs_ms': [round(sample, 2) for sample in samples_ms],
+        'min_ms': round(ordered[0], 2),
+        'median_ms': round(statistics.median(ordered), 2),
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))], 2),
+    }
+
+
+def _timed_run(at, element=None):
+    start = time.perf_counter()
+    if element is None:
+        at.run(timeout=APPTEST_TIMEOUT)
+    else:
+        element.run(timeout=APPTEST_TIMEOUT)
+    elapsed = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise RuntimeError(f"La app falló durante el benchmark: {at.exception[0].message}")
+    return elapsed
+
+
+def bench_home(repeat):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=APPTEST_TIMEOUT)
+    cold = _timed_run(at)
+    warm = [_timed_run(at) for _ in range(repeat)]
+    return {'primer_rerun_ms': round(cold, 2), **_summary(warm)}
+
+
+def bench_detail(propiedad_id, repeat, pages):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(APP_PATH, default_timeout=APPTEST_TIMEOUT)
+    at.session_state['selected_propiedad'] = propiedad_id
+    cold = _timed_run(at)
+    warm = [_timed_run(at) for _ in range(repeat)]
+    paging = []
+    for _ in range(pages):
+        siguiente = [button for button in at.button if button.key == f"comprobantes_next_{propiedad_id}"]
+        if not siguiente or siguiente[0].disabled:
+            break
+        paging.append(_timed_run(at, siguiente[0].click()))
+    result = {'primer_rerun_ms': round(cold, 2), **_summary(warm)}
+    if paging:
+        result['paginacion'] = _summary(paging)
+    return result
+
+
+def bench_report(repeat):
+    app = import_app()
+    samples = []
+    size = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        size = len(app.ReportGenerator(app.DATABASE).generate_tenant_report().getvalue())
+        samples.append((time.perf_counter() - start) * 1000)
+    return {'bytes_pdf': size, **_summary(samples)}
+
+
+def bench_delete(repeat, exclude):
+    from streamlit.testing.v1 import AppTest
+
+    app = import_app()
+    candidates = [row['propiedad_id'] for row in app.query_db(
+        'SELECT propiedad_id FROM propiedades WHERE propiedad_id != ? ORDER BY propiedad_id DESC LIMIT ?', (exclude, repeat))]
+    at = AppTest.from_file(APP_PATH, default_timeout=APPTEST_TIMEOUT)
+    _timed_run(at)
+    samples = []
+    for propiedad_id in candidates:
+        at.selectbox(key='delete_propiedad_selectbox').set_value(propiedad_id).run(timeout=APPTEST_TIMEOUT)
+        boton = lambda: next(button for button in at.button if button.label == 'Eliminar propiedad')  # noqa: E731
+        boton().click().run(timeout=APPTEST_TIMEOUT)  # primera pulsación: pide confirmación
+        samples.append(_timed_run(at, boton().click()))
+        if app.query_db('SELECT 1 FROM propiedades WHERE propiedad_id = ?', (propiedad_id,), one=True):
+            raise RuntimeError(f"La propiedad {propiedad_id} no se eliminó")
+    return _summary(samples) if samples else {}
+
+
+def _git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(data_dir, benchmarks, repeat, pages):
+    data_dir = os.path.abspath(data_dir)
+    with open(os.path.join(data_dir, DATASET_INFO), encoding='utf-8') as f:
+        dataset = json.load(f)
+    results = {}
+    with tempfile.TemporaryDirectory(prefix='rentapp-bench-') as scratch:
+        _copy_dataset(data_dir, scratch)
+        with working_directory(scratch):
+            # El borrado va al final porque modifica la copia de los datos
+            for name in ('inicio', 'detalle', 'informe', 'eliminar_propiedad'):
+                if name not in benchmarks:
+                    continue
+                print(f"Ejecutando {name}...", file=sys.stderr)
+                if name == 'inicio':
+                    results[name] = bench_home(repeat)
+                elif name == 'detalle':
+                    results[name] = bench_detail(dataset['propiedad_historial'], repeat, pages)
+                elif name == 'informe':
+                    results[name] = bench_report(repeat)
+                else:
+                    results[name] = bench_delete(repeat, dataset['propiedad_historial'])
+    return {
+        'revision': _git_revision(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'plataforma': platform.platform(),
+        'dataset': dataset,
+        'resultados': results,
+    }
+
+
+def compare(base_path, new_path):
+    with open(base_path, encoding='utf-8') as f:
+        base = json.load(f)
+    with open(new_path, encoding='utf-8') as f:
+        new = json.load(f)
+    print(f"{'benchmark':<24}{'base (ms)':>12}{'nuevo (ms)':>12}{'cambio':>10}")
+    for name, result in new['resultados'].items():
+        previous = base['resultados'].get(name)
+        if not previous or 'median_ms' not in result or 'median_ms' not in previous:
+            continue
+        change = result['median_ms'] / previous['median_ms'] - 1 if previous['median_ms'] else 0.0
+        print(f"{name:<24}{previous['median_ms']:>12.1f}{result['median_ms']:>12.1f}{change:>+10.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de la app sobre una cartera sintética.")
+    subparsers = parser.add_subparsers(dest='comando', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help="genera un conjunto de datos sintético")
+    generate_parser.add_argument('directorio')
+    generate_parser.add_argument('--propiedades', type=int, default=10000)
+    generate_parser.add_argument('--comprobantes', type=int, default=1000000)
+    generate_parser.add_argument('--archivos', type=int, default=200, help="archivos distintos (imágenes y PDF) en uploads/")
+    generate_parser.add_argument('--historial', type=int, default=240, help="meses de comprobantes de la propiedad del detalle")
+    generate_parser.add_argument('--seed', type=int, default=42)
+
+    run_parser = subparsers.add_parser('run', help="ejecuta los benchmarks sobre un conjunto de datos")
+    run_parser.add_argument('directorio')
+    run_parser.add_argument('--benchmarks', nargs='+', default=['inicio', 'detalle', 'informe', 'eliminar_propiedad'],
+                            choices=['inicio', 'detalle', 'informe', 'eliminar_propiedad'])
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--pages', type=int, default=3, help="páginas de comprobantes a recorrer en el detalle")
+    run_parser.add_argument('--output', help="archivo JSON de resultados (por defecto, la salida estándar)")
+
+    compare_parser = subparsers.add_parser('compare', help="compara dos archivos de resultados")
+    compare_parser.add_argument('base')
+    compare_parser.add_argument('nuevo')
+
+    args = parser.parse_args(argv)
+    if args.comando == 'generate':
+        info = generate(args.directorio, args.propiedades, args.comprobantes, args.archivos, args.historial, args.seed)
+        print(json.dumps(info, indent=2))
+    elif args.comando == 'run':
+        results = json.dumps(run(args.directorio, args.benchmarks, args.repeat, args.pages), indent=2)
+        if args.output:
+            with open(args.output, 'w', encoding='utf-8') as f:
+                f.write(results + '\n')
+        else:
+            print(results)
+    else:
+        compare(args.base, args.nuevo)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+"""Bulk import/export of propiedades and comprobantes from the command line
+
+    python cli.py import propiedades propiedades.csv
+    python cli.py import comprobantes comprobantes.parquet
+    python cli.py export comprobantes comprobantes.csv
+
+Files are read and written in batches, and every import runs inside a
+single transaction with the table's secondary indexes rebuilt at the end.
+"""
+import argparse
+import csv
+import itertools
+import os
+import sqlite3
+import sys
+import time
+
+import streamlit.logger
+
+# app.py se importa fuera de `streamlit run`: silenciar los avisos de modo "bare"
+streamlit.logger.set_log_level('error')
+
+from app import MESES, get_db_connection  # noqa: E402
+
+BATCH_SIZE = 10000
+
+# Columnas intercambiables por tabla y su tipo en Parquet
+TABLE_COLUMNS = {
+    'propiedades': {
+        'propiedad_id': 'int64',
+        'valor_renta': 'float64',
+        'arrendatario': 'string',
+        'fecha_inicio': 'string',
+        'garantia': 'int64',
+        'monto_deposito': 'float64',
+        'comprobante_garantia': 'string',
+        'comprobante_contrato': 'string',
+        'contrato_ruta': 'string',
+        'contrato_sha256': 'string',
+        'contrato_tamano': 'int64',
+        'contrato_mime': 'string',
+    },
+    'comprobantes': {
+        'id': 'int64',
+        'propiedad_id': 'int64',
+        'nombre': 'string',
+        'mes': 'string',
+        'anio': 'int64',
+        'mes_num': 'int64',
+        'ruta': 'string',
+        'sha256': 'string',
+        'tamano': 'int64',
+        'mime': 'string',
+        'original_nombre': 'string',
+        'original_ruta': 'string',
+        'original_tamano': 'int64',
+        'original_mime': 'string',
+    },
+}
+ORDER_BY = {
+    'propiedades': 'propiedad_id',
+    'comprobantes': 'propiedad_id, anio, mes_num, id',
+}
+
+
+def detect_format(path, file_format):
+    if file_format:
+        return file_format
+    return 'parquet' if os.path.splitext(path)[1].lower() in ('.parquet', '.pq') else 'csv'
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        sys.exit("El formato Parquet requiere pyarrow (pip install pyarrow).")
+    return pyarrow
+
+
+# Lectores en streaming: producen lotes de filas como diccionarios
+def read_csv_batches(path, batch_size):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        while True:
+            batch = list(itertools.islice(reader, batch_size))
+            if not batch:
+                break
+            # En CSV una celda vacía equivale a NULL
+            yield [{key: (value if value != '' else None) for key, value in row.items()} for row in batch]
+
+
+def read_parquet_batches(path, batch_size):
+    pa = _require_pyarrow()
+    parquet_file = pa.parquet.ParquetFile(path)
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size):
+        yield record_batch.to_pylist()
+
+
+def _normalize_comprobante(row, row_number):
+    """Validate the month and fill in whichever of mes / mes_num is missing"""
+    mes = row.get('mes') or None
+    mes_num = row.get('mes_num')
+    if mes_num not in (None, ''):
+        try:
+            mes_num = int(mes_num)
+        except (TypeError, ValueError):
+            mes_num = 0
+        if not 1 <= mes_num <= 12:
+            raise ValueError(f"Fila {row_number}: mes_num debe estar entre 1 y 12 (valor: {row.get('mes_num')!r}).")
+        if mes is None:
+            mes = MESES[mes_num - 1]
+        elif mes != MESES[mes_num - 1]:
+            raise ValueError(f"Fila {row_number}: mes {mes!r} no corresponde a mes_num {mes_num}.")
+    elif mes in MESES:
+        mes_num = MESES.index(mes) + 1
+    else:
+        raise ValueError(f"Fila {row_number}: mes debe ser uno de {', '.join(MESES)} (valor: {mes!r}).")
+    row['mes'], row['mes_num'] = mes, mes_num
+    return row
+
+
+def _insert_sql(table, columns):
+    placeholders = ', '.join('?' for _ in columns)
+    sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})"
+    # Las filas existentes se actualizan en lugar de duplicarse: las propiedades
+    # por propiedad_id y los comprobantes por id (presente en las exportaciones)
+    key = 'propiedad_id' if table == 'propiedades' else 'id' if 'id' in columns else None
+    if key is not None:
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != key)
+        sql += f" ON CONFLICT({key}) DO {'UPDATE SET ' + updates if updates else 'NOTHING'}"
+    return sql
+
+
+def _insert_batch(conn, sql, params, first_row):
+    """Insert one batch; a constraint error is reported with the number of the offending row"""
+    conn.execute('SAVEPOINT lote')
+    try:
+        conn.executemany(sql, params)
+    except sqlite3.IntegrityError as error:
+        # Deshacer el lote y repetirlo fila a fila solo para localizar la que falla
+        conn.execute('ROLLBACK TO lote')
+        for row_number, row in enumerate(params, start=first_row + 1):
+            try:
+                conn.execute(sql, row)
+            except sqlite3.IntegrityError as row_error:
+                error = row_error
+                break
+        else:
+            row_number = None
+        location = f"Fila {row_number}" if row_number is not None else "Lote"
+        hint = " (la propiedad no existe)" if 'FOREIGN KEY' in str(error) else ""
+        raise ValueError(f"{location}: {error}{hint}.") from error
+    finally:
+        conn.execute('RELEASE lote')
+
+
+def import_table(table, path, file_format=None, batch_size=BATCH_SIZE, defer_indexes=True):
+    """Load a CSV/Parquet file into a table in one transaction and return the row count"""
+    file_format = detect_format(path, file_format)
+    batches = read_parquet_batches(path, batch_size) if file_format == 'parquet' else read_csv_batches(path, batch_size)
+    known_columns = TABLE_COLUMNS[table]
+    total = 0
+
+    with get_db_connection() as conn:
+        conn.execute('BEGIN IMMEDIATE')
+        deferred_indexes = []
+        if defer_indexes:
+            deferred_indexes = conn.execute(
+                "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                (table,),
+            ).fetchall()
+            for index in deferred_indexes:
+                conn.execute(f"DROP INDEX {index['name']}")
+
+        columns = None
+        sql = None
+        for batch in batches:
+            if columns is None:
+                columns = [column for column in batch[0] if column in known_columns]
+                if table == 'comprobantes':
+                    columns += [column for column in ('mes', 'mes_num') if column not in columns]
+                if 'propiedad_id' not in columns:
+                    raise ValueError(f"El archivo {path} no tiene la columna 'propiedad_id'.")
+                sql = _insert_sql(table, columns)
+            if table == 'comprobantes':
+                batch = [_normalize_comprobante(row, total + i) for i, row in enumerate(batch, start=1)]
+            _insert_batch(conn, sql, [tuple(row.get(column) for column in columns) for row in batch], total)
+            total += len(batch)
+
+        for index in deferred_indexes:
+            conn.execute(index['sql'])
+    return total
+
+
+def export_table(table, path, file_format=None, batch_size=BATCH_SIZE):
+    """Write a table to CSV/Parquet in batches and return the row count"""
+    file_format = detect_format(path, file_format)
+    columns = list(TABLE_COLUMNS[table])
+    total = 0
+
+    with get_db_connection() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY {ORDER_BY[table]}")
+        if file_format == 'parquet':
+            pa = _require_pyarrow()
+            schema = pa.schema([(column, pa.type_for_alias(column_type)) for column, column_type in TABLE_COLUMNS[table].items()])
+            with pa.parquet.ParquetWriter(path, schema) as writer:
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    writer.write_table(pa.Table.from_pylist([dict(row) for row in rows], schema=schema))
+                    total += len(rows)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    writer.writerows(tuple(row) for row in rows)
+                    total += len(rows)
+    return total
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Importa y exporta propiedades y comprobantes en CSV o Parquet.")
+    parser.add_argument('accion', choices=['import', 'export'])
+    parser.add_argument('tabla', choices=list(TABLE_COLUMNS))
+    parser.add_argument('archivo')
+    parser.add_argument('--format', choices=['csv', 'parquet'], help="por defecto se deduce de la extensión del archivo")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--keep-indexes', action='store_true', help="no reconstruir los índices al final de la importación")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    if args.accion == 'import':
+        try:
+            total = import_table(args.tabla, args.archivo, args.format, args.batch_size, defer_indexes=not args.keep_indexes)
+        except ValueError as e:
+            # La transacción se revierte: no queda ninguna fila importada
+            sys.exit(f"Importación cancelada. {e}")
+        verb = 'importadas'
+    else:
+        total = export_table(args.tabla, args.archivo, args.format, args.batch_size)
+        verb = 'exportadas'
+    print(f"{total} filas de {args.tabla} {verb} en {time.perf_counter() - start:.2f} s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
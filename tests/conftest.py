@@ -0,0 +1,27 @@
+import importlib
+import os
+import sys
+
+import pytest
+import streamlit as st
+import streamlit.logger
+
+# app.py se importa fuera de `streamlit run`: silenciar los avisos de modo "bare"
+streamlit.logger.set_log_level('error')
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """Fresh app module with its database and uploads in a temporary directory"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(REPO_DIR)
+    sys.modules.pop('app', None)
+    # Las cachés de Streamlit son del proceso: sin limpiarlas se reutilizarían
+    # el pool y el escritor abiertos sobre la base de datos de otra prueba
+    st.cache_resource.clear()
+    st.cache_data.clear()
+    module = importlib.import_module('app')
+    yield module
+    sys.modules.pop('app', None)
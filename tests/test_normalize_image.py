@@ -0,0 +1,44 @@
+import hashlib
+import io
+import random
+
+from PIL import ExifTags, Image
+
+
+def _jpeg(size, quality=60, orientation=None):
+    rng = random.Random(0)
+    # Ruido de baja resolución ampliado: comprime como una foto
+    noise = Image.frombytes('RGB', (size[0] // 8, size[1] // 8), rng.randbytes((size[0] // 8) * (size[1] // 8) * 3))
+    image = noise.resize(size, Image.BILINEAR)
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[ExifTags.Base.Orientation] = orientation
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=quality, exif=exif)
+    output.seek(0)
+    return output
+
+
+def test_small_compressed_jpeg_is_kept_as_is(app):
+    original = _jpeg((400, 300), quality=40)
+    data = original.getvalue()
+
+    assert app.normalize_image(original) is None
+
+    stored = app.prepare_upload(original, 'recibo.jpg')
+    assert stored['nombre'] == 'recibo.jpg'
+    assert stored['mime'] == 'image/jpeg'
+    assert stored['sha256'] == hashlib.sha256(data).hexdigest()
+
+
+def test_rotated_photo_is_turned_upright(app):
+    normalized, extension = app.normalize_image(_jpeg((400, 300), quality=40, orientation=6))
+
+    assert Image.open(normalized).size == (300, 400)
+    assert extension in ('.webp', '.jpg')
+
+
+def test_large_photo_is_capped(app):
+    normalized, _ = app.normalize_image(_jpeg((app.IMAGE_MAX_DIMENSION + 800, 1200), quality=95))
+
+    assert max(Image.open(normalized).size) == app.IMAGE_MAX_DIMENSION
@@ -0,0 +1,30 @@
+import pytest
+
+
+@pytest.mark.parametrize('path, expected', [
+    ('p12_2024-03.pdf', (12, 3, 2024)),
+    ('12_202403.pdf', (12, 3, 2024)),
+    ('propiedad-12_2024-3.png', (12, 3, 2024)),
+    ('12_Marzo_2024.jpg', (12, 3, 2024)),
+    ('p12-mar-2024.jpg', (12, 3, 2024)),
+    ('P7 Septiembre 2023.PDF', (7, 9, 2023)),
+    ('12/2024-03.pdf', (12, 3, 2024)),
+    ('12\\2024-03.pdf', (12, 3, 2024)),
+    ('2024/12_2024-03.pdf', (12, 3, 2024)),
+    ('recibos/2024/p12-mar-2024.jpg', (12, 3, 2024)),
+])
+def test_parses_documented_forms(app, path, expected):
+    assert app.parse_receipt_filename(path) == expected
+
+
+@pytest.mark.parametrize('path', [
+    '12_2024-13.pdf',
+    '12_2024-00.pdf',
+    '12_1999-03.pdf',
+    '12_ju_2024.pdf',
+    '12_2024.pdf',
+    'recibo_marzo.pdf',
+    '2024/recibo.pdf',
+])
+def test_rejects_near_misses(app, path):
+    assert app.parse_receipt_filename(path) is None
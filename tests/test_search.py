@@ -0,0 +1,20 @@
+def _search(app, texto):
+    propiedades, _ = app.search_propiedades(app.get_data_version(), texto)
+    return [propiedad['propiedad_id'] for propiedad in propiedades]
+
+
+def test_words_can_match_tenant_and_receipt(app):
+    app.execute_db("UPDATE propiedades SET arrendatario = ? WHERE propiedad_id = 3", ("Núñez Pérez",))
+    app.execute_db("UPDATE propiedades SET arrendatario = ? WHERE propiedad_id = 4", ("Núñez Gil",))
+    app.execute_db(
+        "INSERT INTO comprobantes (propiedad_id, nombre, mes, anio, mes_num) VALUES (3, 'pago.pdf', 'Marzo', 2024, 3)"
+    )
+
+    assert _search(app, 'nunez') == [3, 4]
+    assert _search(app, 'marzo') == [3]
+    assert _search(app, 'nunez marzo') == [3]
+    assert _search(app, 'gil marzo') == []
+
+
+def test_search_input_cannot_inject_fts_syntax(app):
+    assert _search(app, '"AND* OR NEAR(') == []
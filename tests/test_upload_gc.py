@@ -0,0 +1,106 @@
+import io
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def gc(app):
+    # Intervalo largo: las pruebas llaman a collect() directamente
+    return app.UploadGarbageCollector(interval=3600)
+
+
+def _age(path, seconds):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def _store(app, content, nombre='recibo.pdf', age=None):
+    stored = app.store_upload(io.BytesIO(content), nombre)
+    path = app.upload_path(stored['ruta'])
+    _age(path, age if age is not None else app.UPLOAD_GC_GRACE_SECONDS * 2)
+    return stored, path
+
+
+def _legacy(app, nombre):
+    path = os.path.join(app.UPLOAD_FOLDER, nombre)
+    with open(path, 'wb') as f:
+        f.write(nombre.encode())
+    _age(path, app.UPLOAD_GC_GRACE_SECONDS * 2)
+    return path
+
+
+def _insert_comprobante(app, nombre, ruta=None, original_ruta=None):
+    app.execute_db(
+        "INSERT INTO comprobantes (propiedad_id, nombre, mes, anio, mes_num, ruta, original_ruta) VALUES (1, ?, 'Marzo', 2024, 3, ?, ?)",
+        (nombre, ruta, original_ruta),
+    )
+
+
+def test_removes_exactly_the_unreferenced_files(app, gc):
+    recibo, recibo_path = _store(app, b'recibo')
+    original, original_path = _store(app, b'original')
+    contrato, contrato_path = _store(app, b'contrato')
+    huerfano, huerfano_path = _store(app, b'huerfano')
+    reciente, reciente_path = _store(app, b'reciente', age=0)
+    _insert_comprobante(app, recibo['nombre'], recibo['ruta'], original['ruta'])
+    app.execute_db("UPDATE propiedades SET contrato_ruta = ? WHERE propiedad_id = 2", (contrato['ruta'],))
+
+    legacy_recibo = _legacy(app, 'viejo_recibo.pdf')
+    legacy_contrato = _legacy(app, 'viejo_contrato.pdf')
+    legacy_huerfano = _legacy(app, 'viejo_huerfano.pdf')
+    _insert_comprobante(app, 'viejo_recibo.pdf')
+    app.execute_db("UPDATE propiedades SET comprobante_contrato = 'viejo_contrato.pdf' WHERE propiedad_id = 3")
+
+    assert gc.collect() == 2
+
+    for kept in (recibo_path, original_path, contrato_path, reciente_path, legacy_recibo, legacy_contrato):
+        assert os.path.exists(kept), kept
+    for removed in (huerfano_path, legacy_huerfano):
+        assert not os.path.exists(removed), removed
+
+
+def test_prunes_emptied_shard_directories(app, gc):
+    huerfano, huerfano_path = _store(app, b'huerfano')
+    recibo, recibo_path = _store(app, b'recibo')
+    _insert_comprobante(app, recibo['nombre'], recibo['ruta'])
+    shard = os.path.dirname(huerfano_path)
+
+    assert gc.collect() == 1
+
+    assert not os.path.exists(shard)
+    assert not os.path.exists(os.path.dirname(shard))
+    assert os.path.exists(recibo_path)
+    assert os.path.isdir(app.UPLOAD_FOLDER)
+
+
+def test_keeps_file_renewed_after_listing(app, gc, monkeypatch):
+    _, path = _store(app, b'reutilizado')
+    referenced = gc._referenced
+
+    def renew_then_check(references):
+        # Otra subida del mismo contenido renueva el archivo mientras se consulta la base
+        os.utime(path)
+        return referenced(references)
+
+    monkeypatch.setattr(gc, '_referenced', renew_then_check)
+
+    assert gc.collect() == 0
+    assert os.path.exists(path)
+
+
+def test_removes_stale_interrupted_uploads(app, gc):
+    os.makedirs(app.UPLOAD_TMP_FOLDER, exist_ok=True)
+    stale = os.path.join(app.UPLOAD_TMP_FOLDER, 'tmp_viejo')
+    in_progress = os.path.join(app.UPLOAD_TMP_FOLDER, 'tmp_nuevo')
+    for path in (stale, in_progress):
+        with open(path, 'wb') as f:
+            f.write(b'parcial')
+    _age(stale, app.UPLOAD_GC_GRACE_SECONDS * 2)
+
+    assert gc.collect() == 1
+
+    assert not os.path.exists(stale)
+    assert os.path.exists(in_progress)
+    assert os.path.isdir(app.UPLOAD_TMP_FOLDER)
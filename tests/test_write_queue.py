@@ -0,0 +1,49 @@
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def test_concurrent_add_propiedad_gets_unique_ids(app):
+    before = {row['propiedad_id'] for row in app.query_db("SELECT propiedad_id FROM propiedades")}
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        ids = list(executor.map(lambda _: app.add_propiedad(), range(64)))
+
+    assert len(set(ids)) == len(ids)
+    assert before.isdisjoint(ids)
+    after = {row['propiedad_id'] for row in app.query_db("SELECT propiedad_id FROM propiedades")}
+    assert after == before | set(ids)
+
+
+def test_failing_operation_does_not_undo_its_batch(app):
+    writer = app.WriteQueue(app.DATABASE)
+    release = threading.Event()
+    # Mientras el escritor espera, las siguientes operaciones se acumulan en un solo lote
+    blocker = writer.submit(lambda conn: release.wait(5))
+
+    def insert(propiedad_id):
+        return lambda conn: conn.execute("INSERT INTO propiedades (propiedad_id) VALUES (?)", (propiedad_id,)).lastrowid
+
+    first = writer.submit(insert(9001))
+    duplicate = writer.submit(insert(9001))
+    second = writer.submit(insert(9002))
+    release.set()
+
+    blocker.result(timeout=5)
+    first.result(timeout=5)
+    second.result(timeout=5)
+    with pytest.raises(sqlite3.IntegrityError):
+        duplicate.result(timeout=5)
+    rows = app.query_db("SELECT propiedad_id FROM propiedades WHERE propiedad_id IN (9001, 9002) ORDER BY propiedad_id")
+    assert [row['propiedad_id'] for row in rows] == [9001, 9002]
+
+
+def test_connection_failure_fails_queued_operations(app, tmp_path):
+    writer = app.WriteQueue(str(tmp_path / 'no_existe' / 'database.db'))
+
+    for _ in range(2):
+        # Cada operación falla en lugar de quedarse esperando a un hilo muerto
+        with pytest.raises(sqlite3.OperationalError):
+            writer.submit(lambda conn: None).result(timeout=5)